@@ -5,6 +5,7 @@ from core.config import Config
 from generator.c_world_generator import CWorldGenerator
 from core import database
 from core import world_updater
+from core.villager_manager import VillagerManager
 from core.ticker import Ticker
 
 logging.basicConfig(level=logging.INFO)
@@ -156,7 +157,7 @@ def view_map(map_id):
 
 @app.route("/api/maps/<int:map_id>/start_simulation", methods=["POST"])
 def start_simulation(map_id):
-    if not database.get_map_by_id(map_id):
+    if not database.map_exists(map_id):
         return jsonify({"error": "Map not found"}), 404
     ticker_instance.start_simulation(map_id)
     return jsonify({"success": True, "message": f"Simulation started for map {map_id}"}), 200
@@ -179,11 +180,12 @@ def simulation_status(map_id):
 def get_villagers(map_id):
     ticker_instance.update_activity(map_id)
 
-    snapshot = database.get_world_snapshot(map_id)
+    snapshot = database.get_world_snapshot(map_id, include_grid=False)
     if not snapshot:
         return jsonify({"villagers": [], "houses": []})
     
-    villager_manager = world_updater_instance.villager_manager
+    # 用一次性的管理器加载快照：tick 线程正在使用的管理器会原地更新对象，不能在请求线程里改动它
+    villager_manager = VillagerManager(config)
     villager_manager.load_from_database(snapshot)
     villagers_data = villager_manager.get_villagers_data()
     houses_data = villager_manager.get_houses_data()
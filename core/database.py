@@ -2,10 +2,11 @@
 import os
 import sqlite3
 import json
-from contextlib import closing
+from contextlib import closing, contextmanager
 import logging
 from typing import Optional, List, Dict, Tuple, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from core import pack_utils
 
 # --- 异常类定义 ---
 class DatabaseError(Exception):
@@ -22,15 +23,19 @@ class InvalidInputError(DatabaseError):
 
 
 # --- 数据类定义 ---
+# 内存中的地形网格：每行一个 bytearray，每瓦片 1 字节，按 grid[y][x] 访问
+Grid = List[bytearray]
+
 @dataclass
 class WorldSnapshot:
     """封装了一个tick开始时世界状态的完整快照，供WorldUpdater使用。"""
     map_id: int
     width: int
     height: int
-    grid_2d: List[List[int]]
+    grid_2d: Grid
     villagers: List[Dict[str, Any]]
     houses: List[Dict[str, Any]]
+    map_blob: bytearray = field(default_factory=bytearray)  # 【新】打包地形数据，提交时就地打补丁，免去再查一次和整块复制
 
 # --- 模块设置 ---
 logger = logging.getLogger(__name__)
@@ -39,49 +44,96 @@ DATA_DIR = os.path.join(BASE_DIR, '..', 'database')
 os.makedirs(DATA_DIR, exist_ok=True)
 DB_PATH = os.path.join(DATA_DIR, 'world_maps.db')
 
+# 脏字节超过整块数据的这一比例时，直接整块 UPDATE 比逐段写入更划算
+_BLOB_PATCH_MAX_RATIO = 0.3
+
 # --- 内部辅助函数 ---
 def _get_connection():
-    """获取数据库连接，并启用外键约束和WAL模式以支持高并发。"""
+    """
+    获取数据库连接，并启用外键约束和WAL模式以支持高并发。
+    【新】WAL 下 synchronous=NORMAL 只在检查点时 fsync，临时表放在内存中。
+    页缓存和内存映射是按连接的，而这里的连接用完即关，调大它们没有收益，因此保持默认值。
+    """
     conn = sqlite3.connect(DB_PATH, timeout=10.0)
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
     return conn
 
-def _unpack_3bit_bytes(packed_bytes: bytes, width: int, height: int) -> List[List[int]]:
-    """将3-bit打包的BLOB解包成二维列表。"""
-    if not packed_bytes: return [[0] * width for _ in range(height)]
-    grid = [[0] * width for _ in range(height)]
-    for i in range(width * height):
-        byte_idx, bit_offset = divmod(i * 3, 8)
-        if byte_idx >= len(packed_bytes): break
-        y, x = divmod(i, width)
-        if bit_offset <= 5:
-            grid[y][x] = (packed_bytes[byte_idx] >> (5 - bit_offset)) & 0b111
-        else:
-            b1 = packed_bytes[byte_idx]
-            b2 = packed_bytes[byte_idx + 1] if byte_idx + 1 < len(packed_bytes) else 0
-            bits_in_b1 = 8 - bit_offset
-            val = ((b1 & ((1 << bits_in_b1) - 1)) << (3 - bits_in_b1)) | (b2 >> (8 - (3 - bits_in_b1)))
-            grid[y][x] = val
-    return grid
-
-def _write_tile_to_blob(packed_data: bytearray, x: int, y: int, value: int, width: int):
-    """向给定的bytearray中精确写入单个瓦片的值。"""
-    i = y * width + x
-    byte_idx, bit_offset = divmod(i * 3, 8)
-    if byte_idx >= len(packed_data): return
-    if bit_offset <= 5:
-        mask = ~(0b111 << (5 - bit_offset))
-        packed_data[byte_idx] = (packed_data[byte_idx] & mask) | (value << (5 - bit_offset))
-    else:
-        bits_in_b1 = 8 - bit_offset
-        mask1 = ~((1 << bits_in_b1) - 1)
-        packed_data[byte_idx] = (packed_data[byte_idx] & mask1) | (value >> (3 - bits_in_b1))
-        if byte_idx + 1 < len(packed_data):
-            mask2 = ~(((1 << (3 - bits_in_b1)) - 1) << (8 - (3 - bits_in_b1)))
-            packed_data[byte_idx + 1] = (packed_data[byte_idx + 1] & mask2) | ((value & ((1 << (3 - bits_in_b1)) - 1)) << (8 - (3 - bits_in_b1)))
+@contextmanager
+def _connection_scope(conn: Optional[sqlite3.Connection] = None):
+    """【新】有外部连接时直接复用（由调用方负责提交），否则打开一个独立连接并在结束时提交、关闭。"""
+    if conn is not None:
+        yield conn
+        return
+    with closing(_get_connection()) as own_conn:
+        with own_conn:
+            yield own_conn
+
+@contextmanager
+def _savepoint(conn: sqlite3.Connection, name: str):
+    """【新】用 SAVEPOINT 包住一组写入：出错只回滚这一组，不影响同一事务里的其他写入。"""
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    except BaseException:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        raise
+    conn.execute(f"RELEASE {name}")
+
+def _unpack_3bit_bytes(packed_bytes: bytes, width: int, height: int) -> Grid:
+    """将3-bit打包的BLOB解包成按行存放的 bytearray 网格。"""
+    if not packed_bytes: return [bytearray(width) for _ in range(height)]
+    tiles = pack_utils.unpack_3bit_bytes(packed_bytes, width * height)
+    return [bytearray(tiles[y * width:(y + 1) * width]) for y in range(height)]
+
+def _write_tile_changes(conn: sqlite3.Connection, map_id: int, packed: bytearray, width: int, height: int,
+                        tile_changes: List[Tuple[int, int, int]]):
+    """
+    【新】把瓦片变更就地打到 packed 上，并只把改动过的字节区间写回 map_data（SQLite 增量 BLOB I/O）。
+    没有脏字节时什么都不写；脏字节占比过高时退回整块 UPDATE。
+    """
+    ranges = pack_utils.patch_tiles(packed, width, height, tile_changes)
+    if not ranges:
+        return
+    if sum(end - start for start, end in ranges) > len(packed) * _BLOB_PATCH_MAX_RATIO:
+        conn.execute("UPDATE world_maps SET map_data=? WHERE id=?", (bytes(packed), map_id))
+        return
+    # world_maps.id 是 INTEGER PRIMARY KEY，即 rowid
+    with conn.blobopen("world_maps", "map_data", map_id) as blob:
+        for start, end in ranges:
+            blob.seek(start)
+            blob.write(packed[start:end])
 
 # --- 公共API ---
+@contextmanager
+def read_transaction():
+    """
+    【新】开启一个只读事务：其中的多次读取看到同一个一致的快照，且不持有写锁，
+    WAL 下其他连接的写入不必等待。只用于读取，写入请放到 transaction() 中。
+    """
+    with closing(_get_connection()) as conn:
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+@contextmanager
+def transaction():
+    """
+    【新】开启一个可被多次写入共享的事务，退出时统一提交（出错则整体回滚）。
+    把返回的连接作为 conn 传给 commit_changes，多张地图的同一 tick 只需一次提交。
+    用 BEGIN IMMEDIATE 在开始时就拿到写锁，避免 WAL 下延迟事务升级为写事务时遇到 SQLITE_BUSY_SNAPSHOT；
+    写锁会一直持有到提交，期间其他连接的写入只能等待，因此事务内只应做写入，耗时的计算放在外面。
+    """
+    with closing(_get_connection()) as conn:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+
 def init_db():
     """【新】初始化数据库。此函数创建所有表结构。"""
     with _get_connection() as conn:
@@ -152,49 +204,64 @@ def init_db():
         conn.commit()
         logger.info("Database initialized and all tables are ensured to exist.")
 
-def get_world_snapshot(map_id: int) -> Optional[WorldSnapshot]:
-    """获取一个完整的世界状态快照，包含解包后的地形和所有实体。"""
+def get_world_snapshot(map_id: int, conn: Optional[sqlite3.Connection] = None, include_grid: bool = True) -> Optional[WorldSnapshot]:
+    """
+    获取一个完整的世界状态快照，包含解包后的地形和所有实体。可传入 read_transaction() 的连接以复用同一个读快照。
+    【新】include_grid=False 时不读取、不解包地形（grid_2d 为空），供只需要实体数据的接口使用。
+    """
     try:
-        with closing(_get_connection()) as conn:
+        with _connection_scope(conn) as conn:
             conn.row_factory = sqlite3.Row
             
-            map_row = conn.execute("SELECT width, height, map_data FROM world_maps WHERE id=?", (map_id,)).fetchone()
+            if include_grid:
+                map_row = conn.execute("SELECT width, height, map_data FROM world_maps WHERE id=?", (map_id,)).fetchone()
+            else:
+                map_row = conn.execute("SELECT width, height, NULL FROM world_maps WHERE id=?", (map_id,)).fetchone()
             if not map_row: return None
             width, height, map_blob = map_row
 
             villagers = [dict(row) for row in conn.execute("SELECT * FROM villagers WHERE map_id=? AND is_alive=1", (map_id,)).fetchall()]
             houses_rows = conn.execute("SELECT * FROM houses WHERE map_id=? AND is_standing=1", (map_id,)).fetchall()
             
-            grid_2d = _unpack_3bit_bytes(map_blob, width, height)
+            grid_2d = _unpack_3bit_bytes(map_blob, width, height) if include_grid else []
             houses = []
             for row in houses_rows:
                 house = dict(row)
                 house['current_occupants'] = json.loads(house.get('current_occupants') or '[]')
                 houses.append(house)
 
-            return WorldSnapshot(map_id, width, height, grid_2d, villagers, houses)
+            return WorldSnapshot(map_id, width, height, grid_2d, villagers, houses, bytearray(map_blob or b""))
             
     except Exception as e:
         logger.error(f"Failed to get world snapshot for map {map_id}: {e}", exc_info=True)
         return None
 
-def commit_changes(map_id: int, changeset: Dict[str, List[Any]]):
+def commit_changes(map_id: int, changeset: Dict[str, List[Any]], snapshot: Optional[WorldSnapshot] = None,
+                   conn: Optional[sqlite3.Connection] = None) -> Optional[bytearray]:
+    """
+    将一个 tick 的变更集写入数据库。返回写入后的地形打包数据；没有地形变更时返回 None。
+    【新】若传入本 tick 的 snapshot，地形补丁直接就地打在快照携带的打包数据上（snapshot.map_blob 会被修改），
+    不再重新 SELECT 整块 map_data，也不再每个 tick 复制一份。
+    地形只由 tick 循环写入，快照读取后到提交前不会被其他路径改动。
+    【新】传入 conn 时写入并入调用方的事务（见 transaction()），失败只回滚本次变更集。
+    """
+    new_blob = None
     try:
-        with closing(_get_connection()) as conn:
-            with conn: 
+        with _connection_scope(conn) as conn:
+            with _savepoint(conn, "commit_changes"):
                 # Block 1: initial_creation_pairs (no change)
                 initial_pairs = changeset.get("initial_creation_pairs", [])
                 for villager_obj, house_obj in initial_pairs:
                     house_cursor = conn.execute("INSERT INTO houses (map_id, x, y, capacity, current_occupants, food_storage, wood_storage, seeds_storage, build_tick, is_standing) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (map_id, house_obj.x, house_obj.y, house_obj.capacity, "[]", house_obj.food_storage, house_obj.wood_storage, house_obj.seeds_storage, house_obj.build_tick, house_obj.is_standing))
                     real_house_id = house_cursor.lastrowid
-                    villager_cursor = conn.execute("INSERT INTO villagers (map_id, name, gender, age, age_in_ticks, x, y, house_id, hunger, status, current_task, task_progress, last_reproduction_tick, is_alive) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (map_id, villager_obj.name, villager_obj.gender, villager_obj.age, villager_obj.age_in_ticks, villager_obj.x, villager_obj.y, real_house_id, villager_obj.hunger, villager_obj.status.value, villager_obj.current_task, villager_obj.task_progress, villager_obj.last_reproduction_tick, villager_obj.is_alive))
+                    villager_cursor = conn.execute("INSERT INTO villagers (map_id, name, gender, age, age_in_ticks, x, y, house_id, hunger, status, current_task, task_progress, last_reproduction_tick, is_alive) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (map_id, villager_obj.name, villager_obj.gender, villager_obj.age, villager_obj.age_in_ticks, villager_obj.x, villager_obj.y, real_house_id, villager_obj.hunger, villager_obj.status.value, villager_obj.current_task_text, villager_obj.task_progress, villager_obj.last_reproduction_tick, villager_obj.is_alive))
                     real_villager_id = villager_cursor.lastrowid
                     conn.execute("UPDATE houses SET current_occupants=? WHERE id=?", (json.dumps([real_villager_id]), real_house_id))
 
                 # Block 2: new_villagers (no change)
                 new_villagers = changeset.get("new_villagers", [])
                 for villager_obj in new_villagers:
-                    villager_cursor = conn.execute("INSERT INTO villagers (map_id, name, gender, age, age_in_ticks, x, y, house_id, hunger, status, current_task, task_progress, last_reproduction_tick, is_alive) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (map_id, villager_obj.name, villager_obj.gender, villager_obj.age, villager_obj.age_in_ticks, villager_obj.x, villager_obj.y, villager_obj.house_id, villager_obj.hunger, villager_obj.status.value, villager_obj.current_task, villager_obj.task_progress, villager_obj.last_reproduction_tick, villager_obj.is_alive))
+                    villager_cursor = conn.execute("INSERT INTO villagers (map_id, name, gender, age, age_in_ticks, x, y, house_id, hunger, status, current_task, task_progress, last_reproduction_tick, is_alive) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (map_id, villager_obj.name, villager_obj.gender, villager_obj.age, villager_obj.age_in_ticks, villager_obj.x, villager_obj.y, villager_obj.house_id, villager_obj.hunger, villager_obj.status.value, villager_obj.current_task_text, villager_obj.task_progress, villager_obj.last_reproduction_tick, villager_obj.is_alive))
                     real_villager_id = villager_cursor.lastrowid
                     house_row = conn.execute("SELECT current_occupants FROM houses WHERE id=?", (villager_obj.house_id,)).fetchone()
                     if house_row:
@@ -237,16 +304,17 @@ def commit_changes(map_id: int, changeset: Dict[str, List[Any]]):
                 # Block 6: Regular updates (no change)
                 tile_changes = changeset.get("tile_changes", [])
                 if tile_changes:
-                    map_row = conn.execute("SELECT width, map_data FROM world_maps WHERE id=?", (map_id,)).fetchone()
+                    if snapshot is not None and snapshot.map_blob:
+                        map_row = (snapshot.width, snapshot.height, snapshot.map_blob)
+                    else:
+                        map_row = conn.execute("SELECT width, height, map_data FROM world_maps WHERE id=?", (map_id,)).fetchone()
                     if map_row:
-                        width, map_blob = map_row
-                        map_bytearray = bytearray(map_blob)
-                        for x, y, new_type in tile_changes:
-                            _write_tile_to_blob(map_bytearray, x, y, new_type, width)
-                        conn.execute("UPDATE world_maps SET map_data=? WHERE id=?", (bytes(map_bytearray), map_id))
+                        width, height, map_blob = map_row
+                        new_blob = map_blob if isinstance(map_blob, bytearray) else bytearray(map_blob)
+                        _write_tile_changes(conn, map_id, new_blob, width, height, tile_changes)
                 villager_updates = changeset.get("villager_updates", [])
                 if villager_updates:
-                    update_tuples = [(v.age, v.age_in_ticks, v.x, v.y, v.house_id, v.hunger, v.status.value, v.current_task, v.task_progress, v.last_reproduction_tick, v.is_alive, v.id) for v in villager_updates]
+                    update_tuples = [(v.age, v.age_in_ticks, v.x, v.y, v.house_id, v.hunger, v.status.value, v.current_task_text, v.task_progress, v.last_reproduction_tick, v.is_alive, v.id) for v in villager_updates]
                     conn.executemany("UPDATE villagers SET age=?, age_in_ticks=?, x=?, y=?, house_id=?, hunger=?, status=?, current_task=?, task_progress=?, last_reproduction_tick=?, is_alive=? WHERE id=?", update_tuples)
                 house_updates = changeset.get("house_updates", [])
                 if house_updates:
@@ -265,6 +333,7 @@ def commit_changes(map_id: int, changeset: Dict[str, List[Any]]):
     except Exception as e:
         logger.error(f"Failed to commit changeset for map {map_id}: {e}", exc_info=True)
         raise
+    return new_blob
 
 def insert_map(name: str, width: int, height: int, map_bytes: bytes) -> Optional[int]:
     """插入一张新地图到数据库。"""
@@ -292,6 +361,11 @@ def get_map_by_id(map_id: int) -> Optional[Tuple[int, int, bytes]]:
         cursor = conn.execute("SELECT width, height, map_data FROM world_maps WHERE id=?", (map_id,))
         return cursor.fetchone()
 
+def map_exists(map_id: int) -> bool:
+    """【新】只检查地图是否存在，不把整块打包数据读进内存。"""
+    with closing(_get_connection()) as conn:
+        return conn.execute("SELECT 1 FROM world_maps WHERE id=?", (map_id,)).fetchone() is not None
+
 def delete_map(map_id: int) -> bool:
     """根据 ID 删除地图。"""
     try:
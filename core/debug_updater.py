@@ -11,14 +11,14 @@ logger = logging.getLogger(__name__)
 
 
 def update_debug_logic(
-    grid_2d: List[List[int]], width: int, height: int, current_tick: int
+    grid_2d: List[bytearray], width: int, height: int, current_tick: int
 ) -> bool:
     """
     调试用更新逻辑（渐进式转换 PLAIN 为 FARM_MATURE）：
     1. 找到所有现存的 PLAIN (0) 格子。
     2. 每个 tick，将其中一定比例（例如 1%）随机转换为 FARM_MATURE (4)。
     Args:
-        grid_2d: 二维地图数据列表 (会在此列表上直接修改)。
+        grid_2d: 按行存放的 bytearray 地形网格 (会在此网格上直接修改)。
         width: 地图宽度。
         height: 地图高度。
         current_tick: 当前的 tick 数 (虽然本次逻辑未直接使用，但保留参数)。
@@ -33,10 +33,13 @@ def update_debug_logic(
     plain_coordinates: List[Tuple[int, int]] = []  # 用于存储所有 PLAIN 格子的 (y, x) 坐标
 
     # --- 步骤 1: 遍历地图，收集所有 PLAIN 格子的坐标 ---
+    # 【新】每行用 bytearray.find 在 C 层跳到下一个 PLAIN，不再逐格比较
     for y in range(height):
-        for x in range(width):
-            if grid_2d[y][x] == PLAIN:
-                plain_coordinates.append((y, x))
+        row = grid_2d[y]
+        x = row.find(PLAIN, 0, width)
+        while x >= 0:
+            plain_coordinates.append((y, x))
+            x = row.find(PLAIN, x + 1, width)
 
     # --- 步骤 2: 如果没有 PLAIN 格子，直接返回 False (表示无变化) ---
     if not plain_coordinates:
@@ -55,9 +58,12 @@ def update_debug_logic(
     coordinates_to_convert = random.sample(plain_coordinates, num_to_convert)
 
     # --- 步骤 5: 执行转换 ---
+    # 【新】日志级别只判断一次，关闭 DEBUG 时循环内不产生任何日志调用
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
     for y, x in coordinates_to_convert:
         grid_2d[y][x] = FARM_MATURE
-        logger.debug(f"DebugUpdater: Converted PLAIN tile ({x}, {y}) to FARM_MATURE.")
+        if debug_enabled:
+            logger.debug("DebugUpdater: Converted PLAIN tile (%s, %s) to FARM_MATURE.", x, y)
         changed_any = True
 
     # --- 步骤 6: 返回是否发生了更改 ---
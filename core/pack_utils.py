@@ -0,0 +1,158 @@
+# core/pack_utils.py
+"""
+地图瓦片的 3-bit 打包格式编解码。
+
+数据库中的 map_data、C++ 生成器的输出以及前端解码的都是同一种格式：
+每个瓦片占 3 位，按瓦片顺序从高位到低位紧密排列，末尾不足一字节的部分补 0。
+这里的函数以“每瓦片 1 字节”的扁平 bytes/bytearray 作为解包结果和打包输入。
+存储格式保持 3-bit 不变：它同时是前端 /api/maps 接口的传输格式，
+而查表实现下编解码只占 tick 的很小一部分，换成每瓦片 1 字节反而要多搬运约 2.7 倍数据。
+"""
+import logging
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 3-bit 解包用的字节查找表：每 3 个字节恰好容纳 8 个瓦片，
+# 第 k 个瓦片的位来自这 3 个字节中的固定位置，因此可以对整列字节一次性查表。
+# 8 个瓦片为一组的位布局与地图宽高无关，所有查找表都在模块加载时构建一次，任意尺寸的地图共用。
+def _byte_table(fn) -> bytes:
+    return bytes(fn(b) & 0xFF for b in range(256))
+
+_UNPACK_TABLES = (
+    _byte_table(lambda b: b >> 5),              # 瓦片0 <- 字节0 的高 3 位
+    _byte_table(lambda b: (b >> 2) & 0b111),    # 瓦片1 <- 字节0 的中间 3 位
+    _byte_table(lambda b: (b & 0b11) << 1),     # 瓦片2 高 2 位 <- 字节0 低 2 位
+    _byte_table(lambda b: b >> 7),              # 瓦片2 低 1 位 <- 字节1 最高位
+    _byte_table(lambda b: (b >> 4) & 0b111),    # 瓦片3
+    _byte_table(lambda b: (b >> 1) & 0b111),    # 瓦片4
+    _byte_table(lambda b: (b & 0b1) << 2),      # 瓦片5 高 1 位 <- 字节1 最低位
+    _byte_table(lambda b: b >> 6),              # 瓦片5 低 2 位 <- 字节2 高 2 位
+    _byte_table(lambda b: (b >> 3) & 0b111),    # 瓦片6
+    _byte_table(lambda b: b & 0b111),           # 瓦片7
+)
+
+# 3-bit 打包用的字节查找表：输入是某一列瓦片值，输出是它在目标字节中所占的位
+_PACK_TABLES = (
+    _byte_table(lambda v: (v & 0b111) << 5),    # 瓦片0 -> 字节0 高 3 位
+    _byte_table(lambda v: (v & 0b111) << 2),    # 瓦片1 -> 字节0 中间 3 位
+    _byte_table(lambda v: (v & 0b111) >> 1),    # 瓦片2 高 2 位 -> 字节0 低 2 位
+    _byte_table(lambda v: (v & 0b1) << 7),      # 瓦片2 低 1 位 -> 字节1 最高位
+    _byte_table(lambda v: (v & 0b111) << 4),    # 瓦片3
+    _byte_table(lambda v: (v & 0b111) << 1),    # 瓦片4
+    _byte_table(lambda v: (v & 0b111) >> 2),    # 瓦片5 高 1 位 -> 字节1 最低位
+    _byte_table(lambda v: (v & 0b11) << 6),     # 瓦片5 低 2 位 -> 字节2 高 2 位
+    _byte_table(lambda v: (v & 0b111) << 3),    # 瓦片6
+    _byte_table(lambda v: v & 0b111),           # 瓦片7
+)
+
+# 3 位能表示的合法瓦片值；translate 删除这些字节后剩下的就是越界值
+_VALID_TILE_VALUES = bytes(range(8))
+
+# 【新】整组 8 个瓦片取同一值时打包出的 3 字节，用于全图同值（例如新建的空地图）时直接平铺
+_HOMOGENEOUS_GROUPS = tuple(int(f"{v:03b}" * 8, 2).to_bytes(3, 'big') for v in range(8))
+
+# 【新】patch_tiles 逐瓦片写入用的查找表：瓦片在 16 位窗口中的位置只取决于 bit_offset（0~7），
+# 下标为 bit_offset，值为 (左移位数, 清除该瓦片 3 位的掩码)
+_WINDOW_LUT = tuple((13 - bo, 0xFFFF & ~(0b111 << (13 - bo))) for bo in range(8))
+
+# 单批瓦片变更超过总瓦片数的这一比例时，整体解包-修改-重新打包比逐个写入更快
+_REPACK_CHANGE_RATIO = 1 / 32
+
+def _or_bytes(*parts: bytes) -> bytes:
+    """逐字节按位或，借助大整数运算在 C 层一次完成。"""
+    acc = 0
+    for part in parts:
+        acc |= int.from_bytes(part, 'big')
+    return acc.to_bytes(len(parts[0]), 'big')
+
+def unpack_3bit_bytes(packed_bytes: bytes, total_tiles: int) -> bytes:
+    """【新】把 3-bit 打包数据解包为每瓦片 1 字节的扁平 bytes，整个过程没有逐瓦片的 Python 循环。"""
+    groups = (total_tiles + 7) // 8
+    padded = bytes(packed_bytes[:groups * 3]).ljust(groups * 3, b'\0')
+    b0, b1, b2 = padded[0::3], padded[1::3], padded[2::3]
+    t = _UNPACK_TABLES
+    lanes = (
+        b0.translate(t[0]),
+        b0.translate(t[1]),
+        _or_bytes(b0.translate(t[2]), b1.translate(t[3])),
+        b1.translate(t[4]),
+        b1.translate(t[5]),
+        _or_bytes(b1.translate(t[6]), b2.translate(t[7])),
+        b2.translate(t[8]),
+        b2.translate(t[9]),
+    )
+    tiles = bytearray(groups * 8)
+    for k, lane in enumerate(lanes):
+        tiles[k::8] = lane
+    return bytes(tiles[:total_tiles])
+
+def pack_grid_to_3bit(tiles: bytes) -> bytes:
+    """【新】把每瓦片 1 字节的扁平数据打包为 3-bit BLOB（与 C++ 生成器的 pack_bits 格式一致）。"""
+    total_tiles = len(tiles)
+    groups = (total_tiles + 7) // 8
+    packed_size = (total_tiles * 3 + 7) // 8
+    # 越界值会被查找表截断为低 3 位；整体检查一次即可，不在逐瓦片的路径上判断
+    out_of_range = tiles.translate(None, _VALID_TILE_VALUES)
+    if out_of_range:
+        logger.warning("pack_grid_to_3bit: %d tile values exceed 3 bits (e.g. %d); only the low 3 bits are kept.",
+                       len(out_of_range), out_of_range[0])
+    if total_tiles and tiles.count(tiles[0]) == total_tiles:
+        # 全图同值：末尾补零位只落在最后一个不完整的字节里，需单独清零
+        packed = bytearray((_HOMOGENEOUS_GROUPS[tiles[0] & 0b111] * groups)[:packed_size])
+        spare_bits = packed_size * 8 - total_tiles * 3
+        packed[-1] &= (0xFF << spare_bits) & 0xFF
+        return bytes(packed)
+    padded = bytes(tiles).ljust(groups * 8, b'\0')
+    lanes = [padded[k::8] for k in range(8)]
+    t = _PACK_TABLES
+    packed = bytearray(groups * 3)
+    packed[0::3] = _or_bytes(lanes[0].translate(t[0]), lanes[1].translate(t[1]), lanes[2].translate(t[2]))
+    packed[1::3] = _or_bytes(lanes[2].translate(t[3]), lanes[3].translate(t[4]), lanes[4].translate(t[5]), lanes[5].translate(t[6]))
+    packed[2::3] = _or_bytes(lanes[5].translate(t[7]), lanes[6].translate(t[8]), lanes[7].translate(t[9]))
+    return bytes(packed[:packed_size])
+
+def patch_tiles(packed: bytearray, width: int, height: int, tile_changes: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+    """
+    【新】把一批瓦片变更就地写入打包数据，返回实际改动过的字节区间 [start, end)（相邻区间已合并）。
+    少量变更逐个写入，并只比较被触及的字节；大批变更则整体解包后重新打包，有改动时返回整块区间。
+    """
+    total_tiles = width * height
+    size = len(packed)
+    if len(tile_changes) > total_tiles * _REPACK_CHANGE_RATIO:
+        tiles = bytearray(unpack_3bit_bytes(packed, total_tiles))
+        for x, y, new_type in tile_changes:
+            tiles[y * width + x] = new_type
+        repacked = pack_grid_to_3bit(tiles)
+        if repacked == packed:
+            return []
+        packed[:] = repacked
+        return [(0, size)]
+    # 末尾补一个哨兵字节，保证任何瓦片的 16 位窗口都完整可读写，循环内无需边界判断
+    original: Dict[int, int] = {}
+    packed.append(0)
+    try:
+        lut = _WINDOW_LUT
+        for x, y, new_type in tile_changes:
+            bit_index = (y * width + x) * 3
+            byte_idx = bit_index >> 3
+            shift, clear_mask = lut[bit_index & 7]
+            if byte_idx not in original:
+                original[byte_idx] = packed[byte_idx]
+            if byte_idx + 1 not in original:
+                original[byte_idx + 1] = packed[byte_idx + 1]
+            window = ((packed[byte_idx] << 8) | packed[byte_idx + 1]) & clear_mask | (new_type << shift)
+            packed[byte_idx] = window >> 8
+            packed[byte_idx + 1] = window & 0xFF
+    finally:
+        del packed[-1]
+    # 变更可能互相抵消（例如同一 tick 内先开垦再收获），只保留最终确实改变的字节
+    ranges: List[List[int]] = []
+    for i in sorted(original):
+        if i >= size or packed[i] == original[i]:
+            continue
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return [(start, end) for start, end in ranges]
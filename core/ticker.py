@@ -15,7 +15,7 @@ class Ticker:
         """
         初始化 Ticker。
         Args:
-            world_updater: 一个实现了 .update(map_id, tick) 方法的对象。
+            world_updater: 一个实现了 .update_many({map_id: tick}) 和 .invalidate(map_id) 方法的对象。
             tick_interval: 每个tick之间的秒数 (这是1x速的基础)。
             inactivity_timeout: 模拟无活动自动停止的秒数。
         """
@@ -61,6 +61,8 @@ class Ticker:
                 del self.active_maps[map_id]
                 if map_id in self.last_activity:
                     del self.last_activity[map_id]
+                # 停止后地图可能被删除或修改，丢弃更新器里的地形缓存
+                self.world_updater.invalidate(map_id)
                 logger.info(f"Ticker: Stopped simulation for map {map_id}")
 
     def is_simulation_running(self, map_id: int) -> bool:
@@ -78,7 +80,7 @@ class Ticker:
         with self._lock:
             if map_id in self.active_maps:
                  self.last_activity[map_id] = time.time()
-                 logger.debug(f"Ticker: Updated activity for map {map_id}")
+                 logger.debug("Ticker: Updated activity for map %s", map_id)
 
     def _ensure_thread_running(self):
         """确保后台模拟线程正在运行"""
@@ -114,15 +116,15 @@ class Ticker:
             time.sleep(self.tick_interval)
 
             with self._lock:
-                for map_id in maps_to_update:
+                # 【新】所有活动地图的本 tick 合并在一个数据库事务里提交
+                map_ticks = {map_id: self.active_maps[map_id] for map_id in maps_to_update if map_id in self.active_maps}
+                results = self.world_updater.update_many(map_ticks) if map_ticks else {}
+                for map_id, success in results.items():
                     if map_id in self.active_maps:
-                        current_tick = self.active_maps[map_id]
-                        
-                        success = self.world_updater.update(map_id, current_tick)
-                        
+                        current_tick = map_ticks[map_id]
                         if success:
                             self.active_maps[map_id] += 1
-                            logger.debug(f"Ticker: Tick {current_tick + 1} completed for map {map_id}")
+                            logger.debug("Ticker: Tick %s completed for map %s", current_tick + 1, map_id)
                         else:
                             logger.error(f"Ticker: Update failed for map {map_id} at tick {current_tick}. Stopping simulation.")
                             self.stop_simulation(map_id)
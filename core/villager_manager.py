@@ -2,10 +2,12 @@
 import random
 import math
 import logging
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, Iterator, List, Tuple, Optional, Any
 from dataclasses import dataclass, fields
 from enum import Enum
+from functools import lru_cache
 from core import database
+from core.database import Grid
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,24 @@ class TaskType(Enum):
     MOVE_TO_WATER = "move_to_water"
     MOVE_INTO_HOUSE = "move_into_house"
 
+# 内存中的任务表示：(任务类型, 目标x, 目标y)；是否仍在移动由村民的 status 决定
+Task = Tuple[TaskType, int, int]
+
+@lru_cache(maxsize=4096)
+def parse_task(task_text: Optional[str]) -> Optional[Task]:
+    """
+    【新】把数据库中的任务字符串（"move:chop_tree:3,4" 或 "chop_tree:3,4"）解析为 Task。
+    只在加载时调用；同一村民的任务字符串在多个 tick 间不变，缓存命中后几乎无开销。
+    """
+    if not task_text:
+        return None
+    try:
+        parts = task_text.split(':')
+        x_str, y_str = parts[-1].split(',')
+        return (TaskType(parts[-2]), int(x_str), int(y_str))
+    except (IndexError, ValueError):
+        return None
+
 @dataclass
 class Villager:
     id: int
@@ -41,12 +61,21 @@ class Villager:
     house_id: int
     hunger: int
     status: VillagerStatus
-    current_task: Optional[str]
+    current_task: Optional[Task]
     task_progress: int
     last_reproduction_tick: int
     is_alive: bool = True
 
-@dataclass
+    @property
+    def current_task_text(self) -> Optional[str]:
+        """任务在数据库和 API 中的字符串形式，移动中的任务带 "move:" 前缀。"""
+        if self.current_task is None:
+            return None
+        task_type, x, y = self.current_task
+        prefix = "move:" if self.status == VillagerStatus.MOVING else ""
+        return f"{prefix}{task_type.value}:{x},{y}"
+
+@dataclass(slots=True)
 class House:
     id: int
     x: Optional[int]
@@ -59,8 +88,29 @@ class House:
     build_tick: int
     is_standing: bool = True
 
+def _bernoulli_hits(n: int, p: float) -> List[int]:
+    """
+    返回 n 次独立伯努利(p)试验中成功的下标。
+    相邻两次成功之间的失败次数服从几何分布，直接按几何分布跳跃，只需约 n*p+1 个随机数。
+    """
+    if n <= 0 or p <= 0:
+        return []
+    if p >= 1:
+        return list(range(n))
+    log_q = math.log1p(-p)
+    hits: List[int] = []
+    index = -1
+    while True:
+        index += int(math.log(1.0 - random.random()) / log_q) + 1
+        if index >= n:
+            return hits
+        hits.append(index)
+
+VILLAGER_FIELDS = tuple(f.name for f in fields(Villager))
+HOUSE_FIELDS = tuple(f.name for f in fields(House))
+
 class VillagerManager:
-    def __init__(self, config: Any):
+    def __init__(self, config: Any) -> None:
         self.config = config
         self.villagers: Dict[int, Villager] = {}
         self.houses: Dict[int, House] = {}
@@ -68,9 +118,15 @@ class VillagerManager:
         self.next_house_id = 1
         self.farm_maturity_tracker: Dict[Tuple[int, int], int] = {}
         self.targeted_coords: set[Tuple[int, int]] = set()
+        self._alive_count = 0
+        # 当前加载的地图，由 load_from_database 设置；直接调用各方法而未加载快照时为 None
+        self.current_map_id: Optional[int] = None
+        # 近水判定缓存：每张地图一份，以 map_id 为键，多张地图共用一个管理器时切换地图不必重建。
+        # 它保持有效只因为没有任何代码路径会写入或移除 WATER；地图被重新读取时由 invalidate_near_water 丢弃
+        self._near_water_caches: Dict[Optional[int], bytearray] = {}
         self._load_config()
     
-    def _load_config(self):
+    def _load_config(self) -> None:
         villager_cfg = self.config.get_villager()
         tasks_cfg = self.config.get_tasks()
         farming_cfg = self.config.get_farming()
@@ -117,23 +173,51 @@ class VillagerManager:
         self.work_efficiency_child = ai_cfg.get('work_efficiency_child', 0.3)
         self.work_efficiency_elderly = ai_cfg.get('work_efficiency_elderly', 0.5)
 
-    def load_from_database(self, snapshot):
-        self.villagers.clear()
-        self.houses.clear()
-        villager_fields = {f.name for f in fields(Villager)}
-        house_fields = {f.name for f in fields(House)}
+    def load_from_database(self, snapshot: database.WorldSnapshot) -> None:
+        """
+        【新】增量加载：已存在的村民和房屋对象原地更新字段，只为新出现的记录创建对象，
+        并移除快照中已不存在的记录，避免每个 tick 重建全部对象。
+        原地更新会覆盖尚未提交的 changeset 所引用的对象，因此同一个管理器只能由一个线程使用；
+        其他线程（例如 API 请求）需要时应另建一个 VillagerManager。
+        """
+        self.current_map_id = snapshot.map_id
+        seen_villager_ids = set()
         for villager_data in snapshot.villagers:
-            filtered_data = {k: v for k, v in villager_data.items() if k in villager_fields}
-            filtered_data['status'] = VillagerStatus(filtered_data['status'])
-            villager = Villager(**filtered_data)
-            self.villagers[villager.id] = villager
-            self.next_villager_id = max(self.next_villager_id, villager.id + 1)
+            villager_id = villager_data['id']
+            seen_villager_ids.add(villager_id)
+            villager = self.villagers.get(villager_id)
+            if villager is None:
+                filtered_data = {k: villager_data[k] for k in VILLAGER_FIELDS if k in villager_data}
+                filtered_data['status'] = VillagerStatus(filtered_data['status'])
+                filtered_data['current_task'] = parse_task(filtered_data.get('current_task'))
+                self.villagers[villager_id] = Villager(**filtered_data)
+                self.next_villager_id = max(self.next_villager_id, villager_id + 1)
+            else:
+                for name in VILLAGER_FIELDS:
+                    if name in villager_data:
+                        setattr(villager, name, villager_data[name])
+                villager.status = VillagerStatus(villager.status)
+                villager.current_task = parse_task(villager_data.get('current_task'))
+        for villager_id in [vid for vid in self.villagers if vid not in seen_villager_ids]:
+            del self.villagers[villager_id]
+        self._alive_count = sum(1 for v in self.villagers.values() if v.is_alive)
+
+        seen_house_ids = set()
         for house_data in snapshot.houses:
-            filtered_data = {k: v for k, v in house_data.items() if k in house_fields}
-            filtered_data['current_occupants'] = filtered_data.get('current_occupants', [])
-            house = House(**filtered_data)
-            self.houses[house.id] = house
-            self.next_house_id = max(self.next_house_id, house.id + 1)
+            house_id = house_data['id']
+            seen_house_ids.add(house_id)
+            house = self.houses.get(house_id)
+            if house is None:
+                filtered_data = {k: house_data[k] for k in HOUSE_FIELDS if k in house_data}
+                filtered_data['current_occupants'] = filtered_data.get('current_occupants', [])
+                self.houses[house_id] = House(**filtered_data)
+                self.next_house_id = max(self.next_house_id, house_id + 1)
+            else:
+                for name in HOUSE_FIELDS:
+                    if name in house_data:
+                        setattr(house, name, house_data[name])
+        for house_id in [hid for hid in self.houses if hid not in seen_house_ids]:
+            del self.houses[house_id]
 
     def create_initial_villagers(self, world_center_x: int, world_center_y: int) -> List[Tuple[Villager, House]]:
         pairs = []
@@ -148,7 +232,7 @@ class VillagerManager:
         logger.info(f"Prepared initial villager pairs for creation.")
         return pairs
 
-    def update_villagers(self, current_tick: int, world_grid: List[List[int]]) -> Dict[str, Any]:
+    def update_villagers(self, current_tick: int, world_grid: Grid) -> Dict[str, Any]:
         self.targeted_coords.clear()
         
         changeset: Dict[str, List[Any]] = {
@@ -163,7 +247,10 @@ class VillagerManager:
 
         self._update_farm_maturity(current_tick, world_grid, changeset)
         
-        villagers_to_process = list(self.villagers.values())
+        # 每个 tick 只筛选一次存活村民，供各阶段复用；tick 内的死亡通过 _alive_count 实时扣减
+        alive_villagers = [v for v in self.villagers.values() if v.is_alive]
+        self._alive_count = len(alive_villagers)
+        villagers_to_process = alive_villagers.copy()
         random.shuffle(villagers_to_process)
 
         for villager in villagers_to_process:
@@ -176,7 +263,8 @@ class VillagerManager:
             
             # 中断逻辑
             is_in_emergency = villager.hunger < self.hunger_threshold
-            is_handling_emergency = villager.current_task and "HARVEST_FARM" in villager.current_task
+            # 收获本身就是在解决饥饿，不因饥饿被打断
+            is_handling_emergency = villager.current_task is not None and villager.current_task[0] is TaskType.HARVEST_FARM
             if is_in_emergency and not is_handling_emergency and villager.status != VillagerStatus.IDLE:
                 self._release_target_lock(villager)
                 villager.status = VillagerStatus.IDLE
@@ -204,18 +292,18 @@ class VillagerManager:
                     changeset["villager_updates"].append(villager)
             # --- 【核心修正】END ---
 
-        self._process_reproduction(current_tick, changeset)
+        self._process_reproduction(current_tick, changeset, alive_villagers)
         self._process_house_decay(current_tick, changeset)
         
         return changeset
 
-    def _update_age_and_death(self, villager: Villager, changeset: Dict[str, Any]):
+    def _update_age_and_death(self, villager: Villager, changeset: Dict[str, Any]) -> None:
         villager.age_in_ticks += 1
         villager.age = villager.age_in_ticks // self.ticks_per_year
         if self._check_natural_death(villager):
             self._kill_villager(villager, changeset, "died of old age")
 
-    def _update_hunger(self, villager: Villager, changeset: Dict[str, Any]):
+    def _update_hunger(self, villager: Villager, changeset: Dict[str, Any]) -> None:
         villager.hunger = max(0, villager.hunger - self.hunger_loss_per_tick)
 
         warehouse = self.houses.get(villager.house_id)
@@ -229,9 +317,9 @@ class VillagerManager:
         if villager.hunger <= 0:
             self._kill_villager(villager, changeset, "starved to death")
 
-    def _kill_villager(self, villager: Villager, changeset: Dict[str, Any], reason: str):
+    def _kill_villager(self, villager: Villager, changeset: Dict[str, Any], reason: str) -> None:
         if not villager.is_alive: return
-        logger.info(f"Villager {villager.name} (age {villager.age}) {reason}.")
+        logger.info("Villager %s (age %s) %s.", villager.name, villager.age, reason)
         self._release_target_lock(villager)
         
         warehouse = self.houses.get(villager.house_id)
@@ -245,6 +333,7 @@ class VillagerManager:
 
         changeset["deleted_villager_ids"].append(villager.id)
         villager.is_alive = False
+        self._alive_count -= 1
 
     def _can_work(self, villager: Villager, task_type: Optional[TaskType] = None) -> bool:
         age = villager.age
@@ -254,11 +343,10 @@ class VillagerManager:
         return True
 
     # 位于 core/villager_manager.py 中
-    def _decide_next_action(self, villager: Villager, world_grid: List[List[int]]):
+    def _decide_next_action(self, villager: Villager, world_grid: Grid) -> None:
         """
         【最终版】使用“意图锁定”来防止多个村民同时建房。
         """
-        log_prefix = f"[AI DEBUG Villager {villager.name} (ID: {villager.id})]"
         if not self._can_work(villager): return
         
         warehouse = self.houses.get(villager.house_id)
@@ -272,7 +360,7 @@ class VillagerManager:
                 return
 
         # 优先级 3: 农田
-        population = len([v for v in self.villagers.values() if v.is_alive])
+        population = self._alive_count
         farm_count = self._count_farms(world_grid)
         required_farms = math.ceil(population / 2.0) + 1
         if farm_count < required_farms and self._can_work(villager, TaskType.BUILD_FARMLAND):
@@ -314,7 +402,7 @@ class VillagerManager:
         self._productive_action(villager, world_grid)
 
 
-    def _productive_action(self, villager: Villager, world_grid: List[List[int]]):
+    def _productive_action(self, villager: Villager, world_grid: Grid) -> None:
         possible_actions = []
         mature_farm = self._find_nearest_target(villager.x, villager.y, world_grid, FARM_MATURE)
         if mature_farm:
@@ -326,14 +414,14 @@ class VillagerManager:
                 possible_actions.append((TaskType.CHOP_TREE, tree_site))
 
         if not possible_actions:
-            logger.debug(f"Villager {villager.name} has no productive actions available.")
+            logger.debug("Villager %s has no productive actions available.", villager.name)
             return
 
         random.shuffle(possible_actions)
         chosen_task, chosen_site = possible_actions[0]
         self._set_move_task(villager, chosen_task, chosen_site)
 
-    def _complete_task(self, villager: Villager, task_type: TaskType, x: int, y: int, world_grid: List[List[int]], changeset: Dict[str, Any], current_tick: int = 0):
+    def _complete_task(self, villager: Villager, task_type: TaskType, x: int, y: int, world_grid: Grid, changeset: Dict[str, Any], current_tick: int = 0) -> None:
         """
         【最终版】将“搬家”也改为原子请求，彻底杜绝外键错误。
         """
@@ -378,7 +466,7 @@ class VillagerManager:
                 if warehouse not in changeset["house_updates"]:
                     changeset["house_updates"].append(warehouse)
     
-    def _create_child(self, male: Villager, female: Villager, current_tick: int, changeset: Dict[str, Any]):
+    def _create_child(self, male: Villager, female: Villager, current_tick: int, changeset: Dict[str, Any]) -> None:
         if male.house_id is None: return
         warehouse = self.houses.get(male.house_id)
         if not warehouse: return
@@ -410,34 +498,26 @@ class VillagerManager:
         if warehouse.food_storage < total_food_cost: return False
         return True
 
-    def _count_farms(self, world_grid: List[List[int]]) -> int:
-        count = 0
-        for y in range(len(world_grid)):
-            for x in range(len(world_grid[0])):
-                tile = world_grid[y][x]
-                if tile in [FARM_UNTILLED, FARM_MATURE] or (x, y) in self.targeted_coords:
-                     is_farm_task = False
-                     for v in self.villagers.values():
-                         if v.current_task and f":{x},{y}" in v.current_task and "HARVEST_FARM" in v.current_task:
-                             is_farm_task = True
-                             break
-                     if not is_farm_task:
-                        count +=1
+    def _count_farms(self, world_grid: Grid) -> int:
+        # 正被收获的农田不计入；先一次性收集所有收获目标，避免对每块农田遍历全部村民
+        harvest_targets = {(task[1], task[2]) for v in self.villagers.values()
+                           if (task := v.current_task) is not None and task[0] is TaskType.HARVEST_FARM}
+        # 农田总数逐行用 count() 统计；再按目标锁和收获目标做少量修正
+        count = sum(row.count(FARM_UNTILLED) + row.count(FARM_MATURE) for row in world_grid)
+        for x, y in self.targeted_coords:
+            if world_grid[y][x] not in (FARM_UNTILLED, FARM_MATURE):
+                count += 1
+        for x, y in harvest_targets:
+            if world_grid[y][x] in (FARM_UNTILLED, FARM_MATURE) or (x, y) in self.targeted_coords:
+                count -= 1
         return count
     
-    def _release_target_lock(self, villager: Villager):
-        if villager.current_task:
-            try:
-                parts = villager.current_task.split(':')
-                coords_str = parts[-1]
-                x_str, y_str = coords_str.split(',')
-                coords: Tuple[int, int] = (int(x_str), int(y_str))
-                if coords in self.targeted_coords:
-                    self.targeted_coords.remove(coords)
-            except (ValueError, IndexError):
-                pass
-
-    def _update_farm_maturity(self, current_tick: int, world_grid: List[List[int]], changeset: Dict[str, Any]):
+    def _release_target_lock(self, villager: Villager) -> None:
+        if villager.current_task is not None:
+            _, x, y = villager.current_task
+            self.targeted_coords.discard((x, y))
+
+    def _update_farm_maturity(self, current_tick: int, world_grid: Grid, changeset: Dict[str, Any]) -> None:
         matured_farms = []
         for (x, y), creation_tick in list(self.farm_maturity_tracker.items()):
             if current_tick - creation_tick >= self.farm_mature_ticks:
@@ -461,42 +541,20 @@ class VillagerManager:
             return random.random() < death_prob
         return random.random() < self.death_probability_base
 
-    def _process_movement(self, villager: Villager):
-        if not villager.current_task or not villager.current_task.startswith("move:"):
-            self._release_target_lock(villager)
+    def _process_movement(self, villager: Villager) -> None:
+        if villager.current_task is None:
             villager.status = VillagerStatus.IDLE
-            villager.current_task = None
-            return
-        try:
-            parts = villager.current_task.split(':')
-            final_task_name, coords_str = parts[1], parts[2]
-            x_str, y_str = coords_str.split(',')
-            target_x, target_y = int(x_str), int(y_str)
-        except (IndexError, ValueError):
-            self._release_target_lock(villager)
-            villager.status = VillagerStatus.IDLE
-            villager.current_task = None
             return
+        _, target_x, target_y = villager.current_task
         villager.x, villager.y = target_x, target_y
         villager.status = VillagerStatus.WORKING
-        villager.current_task = f"{final_task_name}:{target_x},{target_y}"
         villager.task_progress = 0
 
-    def _process_task(self, villager: Villager, current_tick: int, world_grid: List[List[int]], changeset: Dict[str, Any]):
-        if not villager.current_task:
+    def _process_task(self, villager: Villager, current_tick: int, world_grid: Grid, changeset: Dict[str, Any]) -> None:
+        if villager.current_task is None:
             villager.status = VillagerStatus.IDLE
             return
-        try:
-            task_parts = villager.current_task.split(':')
-            task_type_str, coords_str = task_parts[0], task_parts[1]
-            task_type = TaskType(task_type_str)
-            x_str, y_str = coords_str.split(',')
-            target_x, target_y = int(x_str), int(y_str)
-        except (IndexError, ValueError):
-             self._release_target_lock(villager)
-             villager.status = VillagerStatus.IDLE
-             villager.current_task = None
-             return
+        task_type, target_x, target_y = villager.current_task
         efficiency = self._get_work_efficiency(villager, task_type)
         villager.task_progress += int(efficiency) 
         required_ticks = self.task_durations.get(task_type, 1)
@@ -514,13 +572,43 @@ class VillagerManager:
         if age >= self.elderly_age: return self.work_efficiency_elderly
         return 1.0
     
-    def _is_near_water(self, x: int, y: int, world_grid: List[List[int]]) -> bool:
-        for dx in range(-self.farm_water_distance, self.farm_water_distance + 1):
-            for dy in range(-self.farm_water_distance, self.farm_water_distance + 1):
-                nx, ny = x + dx, y + dy
-                if (0 <= nx < len(world_grid[0]) and 0 <= ny < len(world_grid) and world_grid[ny][nx] == WATER):
-                    return True
-        return False
+    def _is_near_water(self, x: int, y: int, world_grid: Grid) -> bool:
+        cache = self._near_water_caches.get(self.current_map_id)
+        if cache is None:
+            cache = self._build_near_water_cache(world_grid)
+        width = len(world_grid[0])
+        if not (0 <= x < width and 0 <= y < len(world_grid)):
+            return False
+        return cache[y * width + x] == 1
+
+    def invalidate_near_water(self, map_id: Optional[int]) -> None:
+        """【新】丢弃某张地图的近水判定缓存，下次判定时按当时的网格重新计算。"""
+        self._near_water_caches.pop(map_id, None)
+
+    def _build_near_water_cache(self, world_grid: Grid) -> bytearray:
+        """
+        【新】把水域按 farm_water_distance 做一次方形膨胀，结果存为扁平的 bytearray，并记为当前地图的缓存。
+        每张地图只计算一次，之后的近水判定都是一次字节读取；WorldUpdater.invalidate 丢弃地图的地形缓存时
+        会一并丢弃这里的缓存。它保持有效的前提是：没有任何代码路径写入或移除 WATER，
+        tile_changes 只在空地、森林和农田之间转换。若将来有逻辑改动水域，必须同时让这里的缓存失效。
+        """
+        height = len(world_grid)
+        width = len(world_grid[0]) if height else 0
+        d = self.farm_water_distance
+        cache = bytearray(width * height)
+        for y, row in enumerate(world_grid):
+            x = row.find(WATER)
+            if x < 0:
+                continue
+            y0, y1 = max(0, y - d), min(height, y + d + 1)
+            while x >= 0:
+                x0, x1 = max(0, x - d), min(width, x + d + 1)
+                span = b"\x01" * (x1 - x0)
+                for ny in range(y0, y1):
+                    cache[ny * width + x0:ny * width + x1] = span
+                x = row.find(WATER, x + 1)
+        self._near_water_caches[self.current_map_id] = cache
+        return cache
     
     def _create_house(self, x: int, y: int, build_tick: int) -> House:
         house = House(id=-1, x=x, y=y, capacity=999, current_occupants=[], food_storage=0, wood_storage=0, seeds_storage=0, build_tick=build_tick, is_standing=True)
@@ -530,10 +618,10 @@ class VillagerManager:
         target_x, target_y = site
         self.targeted_coords.add(site)
         villager.status = VillagerStatus.MOVING
-        villager.current_task = f"move:{task_type.value}:{target_x},{target_y}"
+        villager.current_task = (task_type, target_x, target_y)
         return True
 
-    def _find_food_action(self, villager: Villager, world_grid: List[List[int]]):
+    def _find_food_action(self, villager: Villager, world_grid: Grid) -> None:
         mature_farm = self._find_nearest_target(villager.x, villager.y, world_grid, FARM_MATURE)
         if mature_farm and self._set_move_task(villager, TaskType.HARVEST_FARM, mature_farm):
             return
@@ -542,116 +630,123 @@ class VillagerManager:
             if farmland_site and self._set_move_task(villager, TaskType.BUILD_FARMLAND, farmland_site):
                 return
     
-    def _find_nearest_target(self, x: int, y: int, world_grid: List[List[int]], target_tile: int) -> Optional[Tuple[int, int]]:
-        max_radius = 250
-        for r in range(max_radius + 1):
-            coords_to_check = set()
-            for i in range(r + 1):
-                j = r - i
-                if i == 0 and j == 0: coords_to_check.add((x, y))
-                else: coords_to_check.update([(x + i, y + j), (x - i, y + j), (x + i, y - j), (x - i, y - j)])
-            
-            coord_list = sorted(list(coords_to_check))
-            random.shuffle(coord_list)
-            for nx, ny in coord_list:
-                if (0 <= nx < len(world_grid[0]) and 0 <= ny < len(world_grid)):
-                    if world_grid[ny][nx] == target_tile and (nx, ny) not in self.targeted_coords:
-                        return (nx, ny)
+    def _find_nearest_target(self, x: int, y: int, world_grid: Grid, target_tile: int) -> Optional[Tuple[int, int]]:
+        for nx, ny in self._iter_ring_candidates(x, y, world_grid):
+            if world_grid[ny][nx] == target_tile and (nx, ny) not in self.targeted_coords:
+                return (nx, ny)
         return None
     
-    def _find_farmland_site(self, x: int, y: int, world_grid: List[List[int]]) -> Optional[Tuple[int, int]]:
-        max_radius = 250
+    def _find_farmland_site(self, x: int, y: int, world_grid: Grid) -> Optional[Tuple[int, int]]:
+        for nx, ny in self._iter_ring_candidates(x, y, world_grid):
+            if world_grid[ny][nx] == PLAIN and (nx, ny) not in self.targeted_coords and self._is_near_water(nx, ny, world_grid):
+                return (nx, ny)
+        return None
+
+    def _iter_ring_candidates(self, x: int, y: int, world_grid: Grid) -> Iterator[Tuple[int, int]]:
+        """
+        【新】由近及远逐圈（曼哈顿距离）产出地图内的候选坐标，每一圈内部顺序随机。
+        圈内采用惰性 Fisher-Yates：每产出一个坐标只做一次交换，调用方命中后即停止，无需打乱整圈。
+        半径超过到最远角落的距离后不再继续。
+        """
+        height = len(world_grid)
+        width = len(world_grid[0])
+        max_radius = min(250, max(x, width - 1 - x) + max(y, height - 1 - y))
+        rand = random.random
         for r in range(max_radius + 1):
-            coords_to_check = set()
+            ring: List[Tuple[int, int]] = []
             for i in range(r + 1):
                 j = r - i
-                if i == 0 and j == 0: coords_to_check.add((x, y))
-                else: coords_to_check.update([(x + i, y + j), (x - i, y + j), (x + i, y - j), (x - i, y - j)])
-            
-            coord_list = sorted(list(coords_to_check))
-            random.shuffle(coord_list)
-            for nx, ny in coord_list:
-                if (0 <= nx < len(world_grid[0]) and 0 <= ny < len(world_grid)):
-                    if world_grid[ny][nx] == PLAIN and (nx, ny) not in self.targeted_coords and self._is_near_water(nx, ny, world_grid):
-                        return (nx, ny)
-        return None
-
-    def _find_house_site(self, x: int, y: int, world_grid: List[List[int]]) -> Optional[Tuple[int, int]]:
+                xs = (x + i, x - i) if i else (x,)
+                ys = (y + j, y - j) if j else (y,)
+                for nx in xs:
+                    if 0 <= nx < width:
+                        for ny in ys:
+                            if 0 <= ny < height:
+                                ring.append((nx, ny))
+            n = len(ring)
+            for k in range(n):
+                m = k + int(rand() * (n - k))
+                ring[k], ring[m] = ring[m], ring[k]
+                yield ring[k]
+
+    def _find_house_site(self, x: int, y: int, world_grid: Grid) -> Optional[Tuple[int, int]]:
         return self._find_nearest_target(x, y, world_grid, PLAIN)
     
-    def _process_reproduction(self, current_tick: int, changeset: Dict[str, Any]):
-        adults = [v for v in self.villagers.values() if v.is_alive and 
-                 self.reproduction_age_min <= v.age <= self.reproduction_age_max]
-        for male in adults:
-            if male.gender != "male": continue
-            for female in adults:
-                if (female.gender != "female" or male.id == female.id or
-                    abs(male.age - female.age) > self.reproduction_age_diff_max or
+    def _process_reproduction(self, current_tick: int, changeset: Dict[str, Any], alive_villagers: List[Villager]) -> None:
+        males: List[Villager] = []
+        females: List[Villager] = []
+        for v in alive_villagers:
+            if v.is_alive and self.reproduction_age_min <= v.age <= self.reproduction_age_max:
+                if v.gender == "male":
+                    males.append(v)
+                elif v.gender == "female":
+                    females.append(v)
+        for male in males:
+            for female in females:
+                if (abs(male.age - female.age) > self.reproduction_age_diff_max or
                     current_tick - male.last_reproduction_tick < self.reproduction_cooldown_ticks or
                     current_tick - female.last_reproduction_tick < self.reproduction_cooldown_ticks):
                     continue
                 if self._can_reproduce(male, female):
                     self._create_child(male, female, current_tick, changeset)
     
-    def _process_house_decay(self, current_tick: int, changeset: Dict[str, Any]):
+    def _process_house_decay(self, current_tick: int, changeset: Dict[str, Any]) -> None:
         """
         【新】在处理居民前，增加对None值的检查，确保代码健壮性。
         """
-        houses_to_process = list(self.houses.values())
-        for house in houses_to_process:
-            if not house.is_standing or house.x is None: 
-                continue
-
-            age_ticks = current_tick - house.build_tick
-            if age_ticks > self.house_decay_ticks and random.random() < self.house_decay_probability:
-                logger.info(f"House {house.id} at ({house.x}, {house.y}) collapsed.")
-                house.is_standing = False
+        # 只有超过寿命的房屋才可能倒塌；用几何分布跳跃抽样，只为真正倒塌的房屋消耗随机数
+        decaying_houses = [h for h in self.houses.values()
+                           if h.is_standing and h.x is not None and current_tick - h.build_tick > self.house_decay_ticks]
+        for index in _bernoulli_hits(len(decaying_houses), self.house_decay_probability):
+            house = decaying_houses[index]
+            logger.info("House %s at (%s, %s) collapsed.", house.id, house.x, house.y)
+            house.is_standing = False
+            
+            # 从字典中安全地获取居民对象列表
+            residents_to_relocate = [self.villagers.get(vid) for vid in house.current_occupants]
+            num_residents = len([res for res in residents_to_relocate if res is not None and res.is_alive])
+
+            if num_residents > 0:
+                base_food, rem_food = divmod(house.food_storage, num_residents)
+                base_wood, rem_wood = divmod(house.wood_storage, num_residents)
+                base_seeds, rem_seeds = divmod(house.seeds_storage, num_residents)
                 
-                # 从字典中安全地获取居民对象列表
-                residents_to_relocate = [self.villagers.get(vid) for vid in house.current_occupants]
-                num_residents = len([res for res in residents_to_relocate if res is not None and res.is_alive])
-
-                if num_residents > 0:
-                    base_food, rem_food = divmod(house.food_storage, num_residents)
-                    base_wood, rem_wood = divmod(house.wood_storage, num_residents)
-                    base_seeds, rem_seeds = divmod(house.seeds_storage, num_residents)
+                # 使用一个计数器来公平分配余数
+                resident_counter = 0 
+                for villager in residents_to_relocate:
+                    # --- 【核心修正】START: 增加对None值的防御性检查 ---
+                    # 在访问任何属性前，必须确保villager不是None且还活着
+                    if not villager or not villager.is_alive:
+                        continue
+                    # --- 【核心修正】END ---
                     
-                    # 使用一个计数器来公平分配余数
-                    resident_counter = 0 
-                    for villager in residents_to_relocate:
-                        # --- 【核心修正】START: 增加对None值的防御性检查 ---
-                        # 在访问任何属性前，必须确保villager不是None且还活着
-                        if not villager or not villager.is_alive:
-                            continue
-                        # --- 【核心修正】END ---
-                        
-                        food_share = base_food + 1 if resident_counter < rem_food else base_food
-                        wood_share = base_wood + 1 if resident_counter < rem_wood else base_wood
-                        seeds_share = base_seeds + 1 if resident_counter < rem_seeds else base_seeds
-                        resident_counter += 1 # 增加计数器
-                        
-                        new_warehouse = House(id=-1, x=None, y=None, capacity=999, 
-                                              current_occupants=[], 
-                                              food_storage=food_share, 
-                                              wood_storage=wood_share, 
-                                              seeds_storage=seeds_share,
-                                              build_tick=current_tick, is_standing=True)
-                        
-                        changeset["homeless_updates"] = changeset.get("homeless_updates", [])
-                        changeset["homeless_updates"].append((villager, new_warehouse))
-                        
-                        logger.info(f"Villager {villager.name} is now homeless. New virtual warehouse created with assets: "
-                                    f"Food({food_share}), Wood({wood_share}), Seeds({seeds_share}).")
-
-                changeset["deleted_house_ids"].append(house.id)
-    
+                    food_share = base_food + 1 if resident_counter < rem_food else base_food
+                    wood_share = base_wood + 1 if resident_counter < rem_wood else base_wood
+                    seeds_share = base_seeds + 1 if resident_counter < rem_seeds else base_seeds
+                    resident_counter += 1 # 增加计数器
+                    
+                    new_warehouse = House(id=-1, x=None, y=None, capacity=999,
+                                          current_occupants=[],
+                                          food_storage=food_share,
+                                          wood_storage=wood_share,
+                                          seeds_storage=seeds_share,
+                                          build_tick=current_tick, is_standing=True)
+                    
+                    changeset["homeless_updates"] = changeset.get("homeless_updates", [])
+                    changeset["homeless_updates"].append((villager, new_warehouse))
+                    
+                    logger.info("Villager %s is now homeless. New virtual warehouse created with assets: "
+                                "Food(%s), Wood(%s), Seeds(%s).", villager.name, food_share, wood_share, seeds_share)
+
+            changeset["deleted_house_ids"].append(house.id)
+
     def get_villagers_data(self) -> List[Dict[str, Any]]:
-        return [{"id": v.id, "name": v.name, "gender": v.gender, "age": v.age, "x": v.x, "y": v.y, "hunger": v.hunger, "status": v.status.value, "current_task": v.current_task, "house_id": v.house_id} for v in self.villagers.values() if v.is_alive]
+        return [{"id": v.id, "name": v.name, "gender": v.gender, "age": v.age, "x": v.x, "y": v.y, "hunger": v.hunger, "status": v.status.value, "current_task": v.current_task_text, "house_id": v.house_id} for v in self.villagers.values() if v.is_alive]
     
     def get_houses_data(self) -> List[Dict[str, Any]]:
         return [{"id": h.id, "x": h.x, "y": h.y, "occupants": len(h.current_occupants), "food_storage": h.food_storage, "is_standing": h.is_standing} for h in self.houses.values() if h.is_standing and h.x is not None]
     
-    def create_and_store_initial_villagers(self, map_id: int, width: int, height: int):
+    def create_and_store_initial_villagers(self, map_id: int, width: int, height: int) -> None:
         """
         【新】这是一个全新的函数。
         它负责创建初始村民对象，并直接将它们原子化地写入数据库。
@@ -683,7 +778,7 @@ class VillagerManager:
         """
         count = 0
         for villager in self.villagers.values():
-            if villager.is_alive and villager.current_task and "BUILD_HOUSE" in villager.current_task:
+            if villager.is_alive and villager.current_task is not None and villager.current_task[0] is TaskType.BUILD_HOUSE:
                 count += 1
         return count
     
@@ -708,8 +803,8 @@ class VillagerManager:
         这包括正在移动去建房，和正在建房的村民。
         """
         for villager in self.villagers.values():
-            if villager.is_alive and villager.current_task:
+            if villager.is_alive and villager.current_task is not None:
                 # 检查任务是否是 BUILD_HOUSE，无论他是正在移动还是正在工作
-                if "BUILD_HOUSE" in villager.current_task:
+                if villager.current_task[0] is TaskType.BUILD_HOUSE:
                     return True
         return False
\ No newline at end of file
@@ -1,6 +1,7 @@
 # core/world_updater.py
 import logging
-from typing import Dict, List, Any
+import sqlite3
+from typing import Any, Dict, Optional, Tuple
 from core import database, config
 from core.villager_manager import VillagerManager
 logger = logging.getLogger(__name__)
@@ -9,35 +10,102 @@ class WorldUpdater:
     def __init__(self, config_obj: config.Config):
         self.config = config_obj
         self.villager_manager = VillagerManager(config_obj)
+        # 【新】每张地图上一个 tick 结束时的地形网格及其打包数据，命中时不必再读取、解包整张地图
+        self._grid_cache: Dict[int, Tuple[database.Grid, bytearray]] = {}
         
     def update(self, map_id: int, current_tick: int) -> bool:
         try:
             return self._update_game_logic(map_id, current_tick)
         except Exception as e:
             logger.error(f"Critical error during update for map {map_id} at tick {current_tick}: {e}", exc_info=True)
+            self.invalidate(map_id)
             return False
 
+    def invalidate(self, map_id: int):
+        """【新】丢弃某张地图的地形缓存（连同村民管理器中的近水判定缓存），下一个 tick 会重新从数据库读取。"""
+        self._grid_cache.pop(map_id, None)
+        self.villager_manager.invalidate_near_water(map_id)
+
+    def update_many(self, map_ticks: Dict[int, int]) -> Dict[int, bool]:
+        """
+        【新】推进多张地图各一个 tick，整批只提交一次。
+        先在只读事务中读取快照并计算所有地图的变更（不持有写锁，村民逻辑运行期间其他连接可以正常写入），
+        再在一个短的写事务里统一提交；每张地图的写入包在各自的 SAVEPOINT 中，单张地图失败只回滚它自己的变更。
+        Args:
+            map_ticks: {map_id: current_tick}
+        Returns:
+            {map_id: 是否更新成功}
+        """
+        results: Dict[int, bool] = {}
+        prepared: Dict[int, Tuple[database.WorldSnapshot, Dict[str, Any]]] = {}
+        try:
+            with database.read_transaction() as conn:
+                for map_id, current_tick in map_ticks.items():
+                    try:
+                        tick = self._prepare_tick(map_id, current_tick, conn)
+                    except Exception as e:
+                        logger.error(f"Critical error during update for map {map_id} at tick {current_tick}: {e}", exc_info=True)
+                        tick = None
+                    if tick is None:
+                        self.invalidate(map_id)
+                        results[map_id] = False
+                    else:
+                        prepared[map_id] = tick
+            with database.transaction() as conn:
+                for map_id, (snapshot, changes) in prepared.items():
+                    results[map_id] = self._commit_tick(map_id, snapshot, changes, conn)
+        except Exception as e:
+            logger.error(f"Failed to commit batched tick for maps {list(map_ticks)}: {e}", exc_info=True)
+            for map_id in map_ticks:
+                self.invalidate(map_id)
+            return {map_id: False for map_id in map_ticks}
+        return results
+
     def _update_game_logic(self, map_id: int, current_tick: int) -> bool:
+        """【新】此函数现在能正确处理 villager_manager 返回的各种变更请求。读取和提交各用一个独立连接。"""
+        tick = self._prepare_tick(map_id, current_tick)
+        if tick is None:
+            self.invalidate(map_id)
+            return False
+        snapshot, changes = tick
+        return self._commit_tick(map_id, snapshot, changes)
+
+    def _prepare_tick(self, map_id: int, current_tick: int,
+                      conn: Optional[sqlite3.Connection] = None) -> Optional[Tuple[database.WorldSnapshot, Dict[str, Any]]]:
         """
-        【新】此函数现在能正确处理 villager_manager 返回的各种变更请求。
+        【新】读取快照并运行村民逻辑，返回 (快照, 变更集)；地图不存在时返回 None。
+        地形优先取自上一个 tick 的缓存，数据库只读取实体数据。变更会同步写进缓存中的网格，
+        因此之后必须调用 _commit_tick，或在失败时 invalidate。
         """
-        snapshot = database.get_world_snapshot(map_id)
+        cached = self._grid_cache.get(map_id)
+        snapshot = database.get_world_snapshot(map_id, conn, include_grid=cached is None)
         if not snapshot:
             logger.error(f"Cannot update: Failed to get world snapshot for map {map_id}.")
-            return False
+            return None
+        if cached is not None:
+            snapshot.grid_2d, snapshot.map_blob = cached
         
         # 加载最新状态
         self.villager_manager.load_from_database(snapshot)
         
         # 执行模拟并获取所有变更
-        villager_changes = self.villager_manager.update_villagers(current_tick, snapshot.grid_2d)
-        
+        return snapshot, self.villager_manager.update_villagers(current_tick, snapshot.grid_2d)
+
+    def _commit_tick(self, map_id: int, snapshot: database.WorldSnapshot, villager_changes: Dict[str, Any],
+                     conn: Optional[sqlite3.Connection] = None) -> bool:
+        """【新】把 _prepare_tick 算出的变更写入数据库（传入 conn 时并入调用方的事务），并更新地形缓存。"""
         # 如果有任何变更，则提交到数据库
         if any(villager_changes.values()):
             try:
-                database.commit_changes(map_id, villager_changes)
+                new_blob = database.commit_changes(map_id, villager_changes, snapshot, conn)
             except Exception as e:
                 logger.error(f"Failed to commit changeset for map {map_id}: {e}")
+                # 网格已被就地修改而数据库已回滚，缓存不再可信
+                self.invalidate(map_id)
                 return False
+            if new_blob is not None:
+                snapshot.map_blob = new_blob
 
-        return True
\ No newline at end of file
+        # update_villagers 会把 tile_changes 同步写进 grid_2d，因此它与新的打包数据一致
+        self._grid_cache[map_id] = (snapshot.grid_2d, snapshot.map_blob)
+        return True
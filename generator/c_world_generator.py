@@ -3,6 +3,7 @@ import os
 import sys
 import ctypes
 import subprocess
+import threading
 from ctypes import c_int, c_double, POINTER, Structure, c_uint8
 
 # --- 新增：定义与 C++ PackedMapResult 对应的 ctypes 结构 ---
@@ -31,8 +32,30 @@ class WaterParams(Structure):
     ]
 
 
+# 【新】优先使用的优化选项；-march=native / -fopenmp 在部分工具链/平台上不可用，失败时退回可移植的 -O2 编译
+# （不带 -fopenmp 时 generator.cpp 中的 OpenMP 指令会被忽略，按单线程运行）
+OPTIMIZE_FLAGS = ["-O3", "-march=native", "-funroll-loops", "-DNDEBUG", "-fopenmp"]
+PORTABLE_FLAGS = ["-O2"]
+
+
 class CWorldGenerator:
+    # 【新】编译检查、CDLL 加载和函数签名设置在整个进程内只做一次，所有实例共享同一个库句柄
+    _lib = None
+    _lib_lock = threading.Lock()
+
     def __init__(self):
+        self.lib = self._load_library()
+
+    @classmethod
+    def _load_library(cls):
+        """返回共享的库句柄，首次调用时按需编译并加载。"""
+        with cls._lib_lock:
+            if cls._lib is None:
+                cls._lib = cls._build_and_load()
+        return cls._lib
+
+    @staticmethod
+    def _build_and_load():
         # 获取当前脚本所在目录
         current_dir = os.path.dirname(__file__)
         
@@ -48,7 +71,6 @@ class CWorldGenerator:
                 "-o",
                 lib_name,
                 src_path,  # 使用完整路径
-                "-O2",
                 "-std=c++11",
                 "-static",
                 "-static-libgcc",
@@ -60,7 +82,6 @@ class CWorldGenerator:
                 "g++", 
                 "-shared", 
                 "-fPIC", 
-                "-O2", 
                 src_path,  # 使用完整路径
                 "-o", 
                 lib_name
@@ -72,12 +93,16 @@ class CWorldGenerator:
         if not os.path.exists(src_path):
             raise RuntimeError(f"Source file not found: {src_path}")
         
-        # 如果DLL/so不存在，则编译
-        if not os.path.exists(lib_name):
+        # 如果DLL/so不存在或比源文件旧，则(重新)编译，保证新增的导出函数可用
+        if not os.path.exists(lib_name) or os.path.getmtime(lib_name) < os.path.getmtime(src_path):
             print(f"🔧 Compiling C++ library: {lib_name}")
             try:
                 # 在正确的目录下执行编译命令
-                subprocess.run(compile_cmd, check=True, cwd=current_dir)
+                try:
+                    subprocess.run(compile_cmd + OPTIMIZE_FLAGS, check=True, cwd=current_dir)
+                except subprocess.CalledProcessError:
+                    print("⚠️ Optimized build failed, retrying with portable flags")
+                    subprocess.run(compile_cmd + PORTABLE_FLAGS, check=True, cwd=current_dir)
                 print("✅ Compilation successful")
             except subprocess.CalledProcessError as e:
                 raise RuntimeError(f"❌ Failed to compile C++ library: {e}")
@@ -86,25 +111,34 @@ class CWorldGenerator:
 
         # 加载DLL/so
         try:
-            self.lib = ctypes.CDLL(lib_name)
+            lib = ctypes.CDLL(lib_name)
             print(f"✅ Loaded library: {lib_name}")
         except Exception as e:
             raise RuntimeError(f"❌ Failed to load library {lib_name}: {e}")
 
         # --- 修改开始：设置新的函数签名 ---
         # 保留原有的 generate_map 签名（如果需要的话）
-        self.lib.generate_map.restype = POINTER(c_uint8)
-        self.lib.generate_map.argtypes = [c_int, c_int, ForestParams, WaterParams]
+        lib.generate_map.restype = POINTER(c_uint8)
+        lib.generate_map.argtypes = [c_int, c_int, ForestParams, WaterParams]
+
+        # 【新】按种子生成，用于复现同一张地图
+        lib.generate_map_seeded.restype = POINTER(c_uint8)
+        lib.generate_map_seeded.argtypes = [c_int, c_int, ForestParams, WaterParams, ctypes.c_uint]
         
         # 设置新函数 generate_map_packed 的签名
         # 返回一个 PackedMapResult 结构体
-        self.lib.generate_map_packed.restype = PackedMapResult
+        lib.generate_map_packed.restype = PackedMapResult
         # 参数类型与 generate_map 相同
-        self.lib.generate_map_packed.argtypes = [c_int, c_int, ForestParams, WaterParams]
+        lib.generate_map_packed.argtypes = [c_int, c_int, ForestParams, WaterParams]
         
+        # 【新】generate_map_packed_into: 直接写入 Python 侧分配的缓冲区，返回写入字节数（失败为 -1）
+        lib.generate_map_packed_into.restype = c_int
+        lib.generate_map_packed_into.argtypes = [c_int, c_int, POINTER(ForestParams), POINTER(WaterParams), POINTER(c_uint8), c_int]
+
         # 保留 free_map 的签名，用于释放 generate_map 或 packed data (作为 uint8_t*)
-        self.lib.free_map.argtypes = [POINTER(c_uint8)]
+        lib.free_map.argtypes = [POINTER(c_uint8)]
         # --- 修改结束 ---
+        return lib
 
 
     def generate_tiles(
@@ -124,22 +158,19 @@ class CWorldGenerator:
             water_density, water_turn_prob, water_stop_prob, water_height_influence
         )
 
-        # --- 修改开始：调用新的打包函数 ---
-        # 调用 C++ 的 generate_map_packed 函数
-        result = self.lib.generate_map_packed(width, height, f_params, w_params)
-        
-        # 检查生成是否成功 (通过检查 data 指针是否为 NULL)
-        if not result.data:
-            raise RuntimeError("Map generation failed in C++ generate_map_packed")
-            
-        # 从 result.data 指针读取 result.size 字节的数据
-        # ctypes.string_at 会创建一个 Python bytes 对象的副本
-        packed_map_bytes = ctypes.string_at(result.data, result.size)
-        
-        # 重要：释放 C++ 中分配的内存
-        # 注意：我们传递的是 result.data（一个指针），而不是 result 本身
-        self.lib.free_map(result.data)
-        
-        # 返回打包好的 bytes 对象
-        return packed_map_bytes
+        # 【新】由 Python 分配打包缓冲区，C++ 直接写入，不再经过 malloc/free 和 string_at 拷贝
+        packed_size = (width * height * 3 + 7) // 8
+        packed_map = bytearray(packed_size)
+        out_ptr = (c_uint8 * packed_size).from_buffer(packed_map)
+        # 参数结构体按引用传递；每次调用各建一份，因为调用期间 GIL 已释放，共享实例会被其他线程改写
+        written = self.lib.generate_map_packed_into(
+            width, height, ctypes.byref(f_params), ctypes.byref(w_params), out_ptr, packed_size
+        )
+        del out_ptr  # 释放对缓冲区的导出引用，之后 bytearray 才能再被改变大小
+
+        if written < 0:
+            raise RuntimeError("Map generation failed in C++ generate_map_packed_into")
+
+        # 返回打包好的 bytearray（sqlite3 与 base64 均可直接接受）
+        return packed_map
         # --- 修改结束 ---
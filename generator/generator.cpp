@@ -42,11 +42,10 @@ static bool is_within_bounds(int x, int y, int width, int height)
     return x >= 0 && x < width && y >= 0 && y < height;
 }
 
-static double *generate_height_field(int width, int height)
+// 【新】高度场与地图其余部分共用同一个随机引擎，固定种子时整张地图可复现
+static double *generate_height_field(int width, int height, mt19937 &gen)
 {
     double *height_arr = new double[width * height];
-    random_device rd;
-    mt19937 gen(rd());
     uniform_real_distribution<> dis(0.0, 1.0);
 
     for (int i = 0; i < width * height; i++)
@@ -77,11 +76,14 @@ static double *generate_height_field(int width, int height)
 }
 
 // --- 新增：位打包辅助函数 ---
-// 将一个包含 tile 值 (0-7, fits in 3 bits) 的一维数组打包成字节数组
-uint8_t* pack_bits(const uint8_t* flat_tiles, int num_tiles, int* out_packed_size) {
-    // Calculate the required size for the packed data
-    *out_packed_size = (num_tiles * 3 + 7) / 8; // Equivalent to ceil((num_tiles * 3) / 8.0)
-    uint8_t* packed_data = new uint8_t[*out_packed_size](); // Initialize to 0
+static int packed_size_for(int num_tiles) {
+    return (num_tiles * 3 + 7) / 8; // Equivalent to ceil((num_tiles * 3) / 8.0)
+}
+
+// 【新】打包到调用方提供的缓冲区（至少 packed_size_for(num_tiles) 字节），缓冲区会先被清零
+static void pack_bits_into(const uint8_t* flat_tiles, int num_tiles, uint8_t* packed_data) {
+    int packed_size = packed_size_for(num_tiles);
+    memset(packed_data, 0, packed_size);
 
     for (int i = 0; i < num_tiles; ++i) {
         uint8_t value = flat_tiles[i] & 0x07; // Ensure only the lowest 3 bits are used
@@ -99,11 +101,18 @@ uint8_t* pack_bits(const uint8_t* flat_tiles, int num_tiles, int* out_packed_siz
             int bits_in_second_byte = 3 - bits_in_first_byte;
             packed_data[byte_index] |= (value >> bits_in_second_byte);
             // Check bounds before writing to the next byte
-            if (byte_index + 1 < *out_packed_size) {
+            if (byte_index + 1 < packed_size) {
                 packed_data[byte_index + 1] |= (value << (8 - bits_in_second_byte)) & 0xFF;
             }
         }
     }
+}
+
+// 将一个包含 tile 值 (0-7, fits in 3 bits) 的一维数组打包成新分配的字节数组
+uint8_t* pack_bits(const uint8_t* flat_tiles, int num_tiles, int* out_packed_size) {
+    *out_packed_size = packed_size_for(num_tiles);
+    uint8_t* packed_data = new uint8_t[*out_packed_size];
+    pack_bits_into(flat_tiles, num_tiles, packed_data);
     return packed_data;
 }
 // --- 新增结束 ---
@@ -113,9 +122,22 @@ extern "C"
 {
 
     EXPORT void free_map(uint8_t *map);
+    EXPORT uint8_t *generate_map_seeded(int width, int height, ForestParams f_params, WaterParams w_params, unsigned int seed);
+
     EXPORT uint8_t *generate_map(int width, int height, ForestParams f_params, WaterParams w_params)
     {
-        srand((unsigned int)time(nullptr));
+        random_device rd;
+        return generate_map_seeded(width, height, f_params, w_params, rd());
+    }
+
+    // 【新】按给定种子生成地图：相同的种子和参数得到相同的地图（与是否以 -fopenmp 编译无关），
+    // 便于复现和测试。返回的数组用 free_map 释放
+    EXPORT uint8_t *generate_map_seeded(int width, int height, ForestParams f_params, WaterParams w_params, unsigned int seed)
+    {
+        // 【新】整张地图只用一个 mt19937 引擎，替代 rand()：周期更长、分布更均匀（RAND_MAX 在部分平台只有 32767），
+        // 也不再依赖全局的 srand 状态
+        mt19937 gen(seed);
+        uniform_real_distribution<> dist01(0.0, 1.0);
         uint8_t *grid = new uint8_t[width * height];
         memset(grid, 0, width * height); // 0 = PLAIN
 
@@ -124,7 +146,7 @@ extern "C"
         {
             for (int x = 0; x < width; x++)
             {
-                double p = (double)rand() / RAND_MAX;
+                double p = dist01(gen);
                 if (p < f_params.seed_prob)
                 {
                     grid[y * width + x] = 1; // FOREST
@@ -133,43 +155,65 @@ extern "C"
         }
 
         // 森林扩张迭代
-        uint8_t *new_grid = new uint8_t[width * height];
+        // 【新】此阶段网格中只有 PLAIN(0) 和 FOREST(1)，因此直接在四周各补一圈 0 的填充网格上迭代：
+        // 8 个邻居按固定偏移相加即可，内层循环不再需要逐个做边界检查
+        int pw = width + 2;
+        int padded_size = pw * (height + 2);
+        uint8_t *cur = new uint8_t[padded_size]();
+        uint8_t *next = new uint8_t[padded_size]();
+        for (int y = 0; y < height; y++)
+        {
+            memcpy(cur + (y + 1) * pw + 1, grid + y * width, width);
+        }
+        // 【新】双缓冲：每轮写满 next 的全部内部格子后交换指针，不再每轮两次整表 memcpy
+        // （填充边框在两个缓冲区中都始终为 0）
+        // 【新】各行只读 cur、只写 next 中属于自己的一行，可按行并行（需以 -fopenmp 编译，否则为单线程）；
+        // 小地图上线程调度的开销大于收益，因此只在行数足够多时启用
         for (int iter = 0; iter < f_params.iterations; iter++)
         {
-            memcpy(new_grid, grid, width * height);
-            for (int y = 0; y < height; y++)
+#pragma omp parallel if (height >= 256)
             {
-                for (int x = 0; x < width; x++)
+                // 共享变量在并行区内按引用访问，且 uint8_t 写入可能与任何对象别名，
+                // 先拷贝为线程内的局部变量，编译器才能把它们留在寄存器里并向量化内层循环
+                const uint8_t *src = cur;
+                uint8_t *dst = next;
+                const int row_len = pw;
+                const int w = width;
+                const int threshold = f_params.birth_threshold;
+                uint8_t *col_sum = new uint8_t[row_len];
+#pragma omp for schedule(static)
+                for (int y = 1; y <= height; y++)
                 {
-                    int count = 0;
-                    for (int dy = -1; dy <= 1; dy++)
+                    const uint8_t *up = src + (y - 1) * row_len;
+                    const uint8_t *mid = src + y * row_len;
+                    const uint8_t *down = src + (y + 1) * row_len;
+                    uint8_t *out = dst + y * row_len;
+                    // 【新】3x3 邻域求和拆成两步：先对每列纵向求三行之和，再横向取相邻三列之和并减去中心格，
+                    // 每格从 8 次读取降为约 6 次加法，且两个循环都是连续访问，便于编译器向量化
+                    for (int x = 0; x < row_len; x++)
                     {
-                        for (int dx = -1; dx <= 1; dx++)
-                        {
-                            if (dx == 0 && dy == 0)
-                                continue;
-                            int nx = x + dx;
-                            int ny = y + dy;
-                            // --- 修复：确保邻居在边界内 ---
-                            if (is_within_bounds(nx, ny, width, height) && grid[ny * width + nx] == 1)
-                            {
-                                count++;
-                            }
-                        }
+                        col_sum[x] = up[x] + mid[x] + down[x];
                     }
-                    // --- 修复：确保当前格子在边界内 ---
-                    if (is_within_bounds(x, y, width, height) && grid[y * width + x] == 0 && count >= f_params.birth_threshold)
+                    for (int x = 1; x <= w; x++)
                     {
-                        new_grid[y * width + x] = 1;
+                        int count = col_sum[x - 1] + col_sum[x] + col_sum[x + 1] - mid[x];
+                        // 已是森林的保持不变；空地在邻居足够多时长出森林
+                        out[x] = mid[x] | (uint8_t)(count >= threshold);
                     }
                 }
+                delete[] col_sum;
             }
-            memcpy(grid, new_grid, width * height);
+            swap(cur, next);
         }
-        delete[] new_grid;
+        for (int y = 0; y < height; y++)
+        {
+            memcpy(grid + y * width, cur + (y + 1) * pw + 1, width);
+        }
+        delete[] cur;
+        delete[] next;
 
         // 生成高度场
-        double *height_field = generate_height_field(width, height);
+        double *height_field = generate_height_field(width, height, gen);
 
         // 水源密度计算
         int num_sources = (int)(width * height * w_params.density);
@@ -177,14 +221,13 @@ extern "C"
             num_sources = 1;
 
         int directions[4][2] = {{0, 1}, {0, -1}, {1, 0}, {-1, 0}};
-        random_device rd2;
-        mt19937 gen(rd2());
-        uniform_real_distribution<> dist01(0.0, 1.0);
+        uniform_int_distribution<int> pick_x(0, width - 1);
+        uniform_int_distribution<int> pick_y(0, height - 1);
 
         for (int i = 0; i < num_sources; i++)
         {
-            int sx = rand() % width;
-            int sy = rand() % height;
+            int sx = pick_x(gen);
+            int sy = pick_y(gen);
             // --- 修复：确保源头在边界内 ---
             if (!is_within_bounds(sx, sy, width, height) || grid[sy * width + sx] == 2)
                 continue;
@@ -193,7 +236,7 @@ extern "C"
             // 打乱方向
             for (int k = 3; k > 0; k--)
             {
-                int j = rand() % (k + 1);
+                int j = uniform_int_distribution<int>(0, k)(gen);
                 swap(directions[k][0], directions[j][0]);
                 swap(directions[k][1], directions[j][1]);
             }
@@ -293,6 +336,24 @@ extern "C"
     }
     // --- 新增结束 ---
 
+    // 【新】生成地图并直接打包进调用方分配的缓冲区，省去一次 new/delete 和 Python 侧的拷贝。
+    // 参数结构体按指针传入，避免 ctypes 按值复制结构体。
+    // 返回写入的字节数；生成失败、参数为空或 out_size 不足时返回 -1。
+    EXPORT int generate_map_packed_into(int width, int height, const ForestParams* f_params, const WaterParams* w_params, uint8_t* out, int out_size) {
+        int num_tiles = width * height;
+        int packed_size = packed_size_for(num_tiles);
+        if (!f_params || !w_params || !out || out_size < packed_size)
+            return -1;
+
+        uint8_t* standard_grid = generate_map(width, height, *f_params, *w_params);
+        if (!standard_grid)
+            return -1;
+
+        pack_bits_into(standard_grid, num_tiles, out);
+        free_map(standard_grid);
+        return packed_size;
+    }
+
 
     EXPORT void free_map(uint8_t *map)
     {
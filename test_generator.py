@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+测试 C++ 地图生成器：同一种子在开启与关闭 OpenMP 时生成的地图逐字节一致
+"""
+import sys
+import os
+import ctypes
+import shutil
+import subprocess
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from generator.c_world_generator import ForestParams, WaterParams
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generator", "generator.cpp")
+
+def build_library(out_dir, name, extra_flags):
+    """把 generator.cpp 编译为共享库；编译器或选项不可用时返回 None"""
+    lib_path = os.path.join(out_dir, name)
+    cmd = ["g++", "-shared", "-fPIC", SRC_PATH, "-o", lib_path, "-O2"] + extra_flags
+    if subprocess.run(cmd, capture_output=True).returncode != 0:
+        return None
+    lib = ctypes.CDLL(lib_path)
+    lib.generate_map_seeded.restype = ctypes.POINTER(ctypes.c_uint8)
+    lib.generate_map_seeded.argtypes = [ctypes.c_int, ctypes.c_int, ForestParams, WaterParams, ctypes.c_uint]
+    lib.free_map.argtypes = [ctypes.POINTER(ctypes.c_uint8)]
+    return lib
+
+def generate(lib, width, height, seed):
+    f_params = ForestParams(0.05, 6, 3)
+    w_params = WaterParams(0.0005, 0.2, 0.01, 2.0)
+    ptr = lib.generate_map_seeded(width, height, f_params, w_params, seed)
+    try:
+        return ctypes.string_at(ptr, width * height)
+    finally:
+        lib.free_map(ptr)
+
+def test_openmp_matches_serial():
+    """测试开启 OpenMP（多线程）与单线程编译对同一种子生成相同的地图"""
+    print("=== 测试 OpenMP 一致性 ===")
+    if shutil.which("g++") is None:
+        pytest.skip("g++ not available")
+    # libgomp 在加载时读取线程数；单核机器上也强制多个线程，确保并行分支真的被执行
+    os.environ["OMP_NUM_THREADS"] = "4"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        serial = build_library(tmp_dir, "serial.so", [])
+        parallel = build_library(tmp_dir, "parallel.so", ["-fopenmp"])
+        if serial is None or parallel is None:
+            pytest.skip("g++ or -fopenmp not available")
+        # 高度 >= 256 时才会进入并行区；小地图走单线程分支，也一并检查
+        for width, height, seed in [(300, 280, 1), (257, 512, 42), (40, 30, 7)]:
+            expected = generate(serial, width, height, seed)
+            assert generate(parallel, width, height, seed) == expected, (width, height, seed)
+            assert generate(serial, width, height, seed) == expected, (width, height, seed)
+        assert generate(serial, 300, 280, 1) != generate(serial, 300, 280, 2)
+
+def main():
+    """主测试函数"""
+    print("开始测试地图生成器...\n")
+    test_openmp_matches_serial()
+    print("\n✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+测试地图 3-bit 打包格式的编解码
+"""
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core import pack_utils
+
+def reference_pack(tiles):
+    """逐瓦片的参考实现，与 C++ 生成器中的 pack_bits 逻辑一致"""
+    packed = bytearray((len(tiles) * 3 + 7) // 8)
+    for i, value in enumerate(tiles):
+        value &= 0b111
+        byte_index, bit_offset = divmod(i * 3, 8)
+        if bit_offset <= 5:
+            packed[byte_index] |= value << (5 - bit_offset)
+        else:
+            bits_in_second_byte = 3 - (8 - bit_offset)
+            packed[byte_index] |= value >> bits_in_second_byte
+            if byte_index + 1 < len(packed):
+                packed[byte_index + 1] |= (value << (8 - bits_in_second_byte)) & 0xFF
+    return bytes(packed)
+
+def reference_apply(packed, width, height, tile_changes):
+    """整体解包-修改-重新打包的参考实现，用来核对 patch_tiles 的就地写入"""
+    tiles = bytearray(pack_utils.unpack_3bit_bytes(packed, width * height))
+    for x, y, value in tile_changes:
+        tiles[y * width + x] = value
+    return pack_utils.pack_grid_to_3bit(tiles)
+
+# 固定随机种子，断言失败时可按同样的输入复现
+SEED = 20240601
+
+def test_pack_matches_reference():
+    """测试打包结果与参考实现逐字节一致"""
+    print("=== 测试打包 ===")
+    rng = random.Random(SEED)
+    for total_tiles in [0, 1, 7, 8, 9, 17, 100, 10001]:
+        tiles = bytes(rng.randrange(8) for _ in range(total_tiles))
+        assert pack_utils.pack_grid_to_3bit(tiles) == reference_pack(tiles), total_tiles
+        for value in range(8):
+            uniform = bytes([value]) * total_tiles
+            assert pack_utils.pack_grid_to_3bit(uniform) == reference_pack(uniform), (total_tiles, value)
+
+def test_unpack_roundtrip():
+    """测试解包是打包的逆运算"""
+    print("=== 测试解包 ===")
+    rng = random.Random(SEED)
+    for total_tiles in [1, 5, 8, 13, 64, 10001]:
+        tiles = bytes(rng.randrange(8) for _ in range(total_tiles))
+        packed = pack_utils.pack_grid_to_3bit(tiles)
+        assert pack_utils.unpack_3bit_bytes(packed, total_tiles) == tiles, total_tiles
+
+def test_patch_tiles_small_and_large_batches():
+    """测试少量与大批量瓦片变更都能正确写入"""
+    print("=== 测试瓦片变更 ===")
+    rng = random.Random(SEED)
+    width, height = 30, 20
+    tiles = bytearray(rng.randrange(5) for _ in range(width * height))
+    packed = pack_utils.pack_grid_to_3bit(tiles)
+    for num_changes in [3, 200]:
+        changes = [(rng.randrange(width), rng.randrange(height), rng.randrange(5)) for _ in range(num_changes)]
+        expected = bytearray(tiles)
+        for x, y, value in changes:
+            expected[y * width + x] = value
+        result = bytearray(packed)
+        pack_utils.patch_tiles(result, width, height, changes)
+        assert result == pack_utils.pack_grid_to_3bit(expected), num_changes
+
+def test_patch_tiles():
+    """测试就地写入返回的脏字节区间恰好覆盖所有改动过的字节"""
+    print("=== 测试就地写入 ===")
+    rng = random.Random(SEED)
+    width, height = 30, 20
+    tiles = bytearray(rng.randrange(5) for _ in range(width * height))
+    packed = pack_utils.pack_grid_to_3bit(tiles)
+    for num_changes in [10, 200]:
+        changes = [(rng.randrange(width), rng.randrange(height), rng.randrange(5)) for _ in range(num_changes)]
+        expected = reference_apply(packed, width, height, changes)
+        patched = bytearray(packed)
+        ranges = pack_utils.patch_tiles(patched, width, height, changes)
+        assert patched == expected, num_changes
+        restored = bytearray(packed)
+        for start, end in ranges:
+            restored[start:end] = expected[start:end]
+        assert restored == expected, num_changes
+        assert all(prev_end < start for (_, prev_end), (start, _) in zip(ranges, ranges[1:]))
+    assert pack_utils.patch_tiles(bytearray(packed), width, height, []) == []
+
+def main():
+    """主测试函数"""
+    print("开始测试打包格式...\n")
+    test_pack_matches_reference()
+    test_unpack_roundtrip()
+    test_patch_tiles_small_and_large_batches()
+    test_patch_tiles()
+    print("\n✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()
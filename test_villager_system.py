@@ -4,11 +4,13 @@
 """
 import sys
 import os
+import random
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from core.config import Config
-from core.villager_manager import VillagerManager, VillagerStatus, TaskType
+from core.villager_manager import VillagerManager, Villager, House, VillagerStatus, TaskType, parse_task, _bernoulli_hits
 from core.world_updater import WorldUpdater
+from core.database import WorldSnapshot
 
 def test_villager_creation():
     """测试村民创建"""
@@ -49,7 +51,7 @@ def test_task_system():
     villagers = vm.create_initial_villagers(500, 500)
     
     # 创建一个简单的世界网格
-    world_grid = [[0 for _ in range(1000)] for _ in range(1000)]
+    world_grid = [bytearray(1000) for _ in range(1000)]
     # 添加一些水
     world_grid[500][500] = 2  # WATER
     world_grid[501][500] = 2  # WATER
@@ -79,7 +81,7 @@ def test_farm_system():
     vm = VillagerManager(config)
     
     # 创建世界网格
-    world_grid = [[0 for _ in range(100)] for _ in range(100)]
+    world_grid = [bytearray(100) for _ in range(100)]
     # 添加水
     world_grid[50][50] = 2  # WATER
     
@@ -129,6 +131,175 @@ def test_reproduction_system():
     can_reproduce = vm._can_reproduce(male, female)
     print(f"是否可以繁殖: {can_reproduce}")
 
+def test_task_text_roundtrip():
+    """测试任务字符串与 (TaskType, x, y) 元组互相转换"""
+    print("\n=== 测试任务字符串转换 ===")
+    vm = VillagerManager(Config())
+    villager = vm.create_initial_villagers(500, 500)[0][0]
+    for text, status in [("move:chop_tree:3,4", VillagerStatus.MOVING),
+                         ("harvest_farm:0,12", VillagerStatus.WORKING),
+                         ("move:build_house:250,7", VillagerStatus.MOVING)]:
+        task = parse_task(text)
+        assert task is not None and isinstance(task[0], TaskType), text
+        villager.current_task, villager.status = task, status
+        assert villager.current_task_text == text, (text, villager.current_task_text)
+
+    villager.current_task = parse_task(None)
+    assert villager.current_task is None
+    assert villager.current_task_text is None
+    for malformed in ["", "chop_tree", "chop_tree:3", "chop_tree:3,4,5", "chop_tree:a,b", "dig_hole:1,2", "move:"]:
+        assert parse_task(malformed) is None, malformed
+
+def add_villager(vm, villager_id, x, y, task=None, status=VillagerStatus.IDLE, hunger=100, wood=0):
+    """在管理器中放入一个成年村民及其虚拟仓库"""
+    house = House(id=villager_id, x=None, y=None, capacity=999, current_occupants=[villager_id],
+                  food_storage=0, wood_storage=wood, seeds_storage=0, build_tick=0)
+    villager = Villager(id=villager_id, name=f"V{villager_id}", gender="male", age=vm.initial_age,
+                        age_in_ticks=vm.initial_age * vm.ticks_per_year, x=x, y=y, house_id=house.id,
+                        hunger=hunger, status=status, current_task=task, task_progress=0, last_reproduction_tick=0)
+    vm.houses[house.id] = house
+    vm.villagers[villager.id] = villager
+    return villager
+
+def test_hunger_does_not_interrupt_harvest():
+    """测试饥饿会打断其他任务，但不会打断收获"""
+    print("\n=== 测试饥饿中断 ===")
+    random.seed(1)
+    vm = VillagerManager(Config())
+    world_grid = [bytearray(5) for _ in range(5)]
+    world_grid[2][2] = 4  # FARM_MATURE
+    world_grid[0][0] = 1  # FOREST
+    hungry = vm.hunger_threshold - 1 + vm.hunger_loss_per_tick  # 本 tick 扣减后刚好低于饥饿阈值
+    harvester = add_villager(vm, 1, 2, 2, (TaskType.HARVEST_FARM, 2, 2), VillagerStatus.WORKING, hunger=hungry)
+    chopper = add_villager(vm, 2, 0, 0, (TaskType.CHOP_TREE, 0, 0), VillagerStatus.WORKING, hunger=hungry)
+    harvester.task_progress = chopper.task_progress = 1
+    vm.update_villagers(0, world_grid)
+    # 收获继续推进；砍树被打断后进度清零（即便重新选中同一棵树也从头开始）
+    assert harvester.current_task == (TaskType.HARVEST_FARM, 2, 2)
+    assert harvester.task_progress == 2
+    assert chopper.task_progress == 0
+
+def test_count_farms_excludes_harvest_targets():
+    """测试农田计数：锁定的开垦目标计入，正被收获的农田不计入"""
+    print("\n=== 测试农田计数 ===")
+    vm = VillagerManager(Config())
+    world_grid = [bytearray(6) for _ in range(6)]
+    world_grid[1][1] = 3  # FARM_UNTILLED
+    world_grid[1][2] = 4  # FARM_MATURE
+    world_grid[1][3] = 4  # FARM_MATURE
+    assert vm._count_farms(world_grid) == 3
+    vm.targeted_coords.add((4, 4))  # 正要开垦的空地
+    assert vm._count_farms(world_grid) == 4
+    add_villager(vm, 1, 0, 0, (TaskType.HARVEST_FARM, 2, 1), VillagerStatus.MOVING)
+    vm.targeted_coords.add((2, 1))
+    assert vm._count_farms(world_grid) == 3
+
+def test_house_construction_throttle():
+    """测试已有村民在建房时，其他村民不再为同一缺口去建房"""
+    print("\n=== 测试建房限流 ===")
+    random.seed(2)
+    vm = VillagerManager(Config())
+    world_grid = [bytearray(6) for _ in range(6)]  # 全是空地：没有水、森林和农田
+    builder = add_villager(vm, 1, 0, 0, (TaskType.BUILD_HOUSE, 5, 5), VillagerStatus.MOVING)
+    idle = add_villager(vm, 2, 3, 3, wood=vm.build_house_wood_cost)
+    vm._alive_count = 2  # 需要 ceil(2/3) = 1 座房屋，已由 builder 在建
+    assert vm._get_house_construction_count() == 1
+    vm._decide_next_action(idle, world_grid)
+    assert idle.current_task is None
+
+    builder.current_task = None
+    vm._decide_next_action(idle, world_grid)
+    assert idle.current_task is not None and idle.current_task[0] is TaskType.BUILD_HOUSE
+
+def test_ring_candidates_cover_grid_in_distance_order():
+    """测试逐圈候选坐标恰好覆盖每个格子一次，且曼哈顿距离单调不减"""
+    print("\n=== 测试逐圈搜索 ===")
+    random.seed(3)
+    vm = VillagerManager(Config())
+    width, height = 9, 7
+    world_grid = [bytearray(width) for _ in range(height)]
+    for x, y in [(0, 0), (8, 6), (4, 3), (0, 5), (7, 1)]:
+        candidates = list(vm._iter_ring_candidates(x, y, world_grid))
+        assert sorted(candidates) == [(cx, cy) for cx in range(width) for cy in range(height)], (x, y)
+        distances = [abs(cx - x) + abs(cy - y) for cx, cy in candidates]
+        assert distances == sorted(distances), (x, y)
+
+def test_near_water_matches_brute_force():
+    """测试近水判定与逐格计算切比雪夫距离的结果一致"""
+    print("\n=== 测试近水判定 ===")
+    rng = random.Random(4)
+    vm = VillagerManager(Config())
+    d = vm.farm_water_distance
+    width, height = 23, 17
+    world_grid = [bytearray(rng.choice((0, 0, 0, 1)) for _ in range(width)) for _ in range(height)]
+    water = [(rng.randrange(width), rng.randrange(height)) for _ in range(6)]
+    for x, y in water:
+        world_grid[y][x] = 2  # WATER
+    for y in range(height):
+        for x in range(width):
+            expected = any(max(abs(x - wx), abs(y - wy)) <= d for wx, wy in water)
+            assert vm._is_near_water(x, y, world_grid) == expected, (x, y)
+    assert not vm._is_near_water(-1, 0, world_grid)
+    assert not vm._is_near_water(width, 0, world_grid)
+
+def test_bernoulli_hits_marginals():
+    """测试几何跳跃抽样的每个下标都以概率 p 命中"""
+    print("\n=== 测试伯努利抽样 ===")
+    random.seed(5)
+    assert _bernoulli_hits(0, 0.5) == []
+    assert _bernoulli_hits(10, 0.0) == []
+    assert _bernoulli_hits(4, 1.0) == [0, 1, 2, 3]
+    n, p, trials = 50, 0.1, 4000
+    counts = [0] * n
+    for _ in range(trials):
+        hits = _bernoulli_hits(n, p)
+        assert hits == sorted(set(hits)) and all(0 <= i < n for i in hits)
+        for i in hits:
+            counts[i] += 1
+    for i, c in enumerate(counts):
+        assert 0.08 <= c / trials <= 0.12, (i, c / trials)
+
+def test_count_farms_matches_reference():
+    """测试农田计数与逐格参考实现一致"""
+    print("\n=== 测试农田计数（随机） ===")
+    rng = random.Random(6)
+    width, height = 12, 9
+    for trial in range(300):
+        vm = VillagerManager(Config())
+        world_grid = [bytearray(rng.choice((0, 0, 1, 3, 4)) for _ in range(width)) for _ in range(height)]
+        vm.targeted_coords = {(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randrange(6))}
+        task_types = list(TaskType)
+        for villager_id in range(1, rng.randrange(8) + 1):
+            task = (rng.choice(task_types), rng.randrange(width), rng.randrange(height)) if rng.random() < 0.8 else None
+            add_villager(vm, villager_id, 0, 0, task, VillagerStatus.MOVING)
+        harvest_targets = {(t[1], t[2]) for v in vm.villagers.values()
+                           if (t := v.current_task) is not None and t[0] is TaskType.HARVEST_FARM}
+        expected = sum(1 for y in range(height) for x in range(width)
+                       if (world_grid[y][x] in (3, 4) or (x, y) in vm.targeted_coords) and (x, y) not in harvest_targets)
+        assert vm._count_farms(world_grid) == expected, trial
+
+def test_near_water_cache_per_map():
+    """测试多张地图轮流更新时近水缓存各算一次，且随 WorldUpdater.invalidate 失效"""
+    print("\n=== 测试近水缓存 ===")
+    updater = WorldUpdater(Config())
+    vm = updater.villager_manager
+    builds = []
+    build = vm._build_near_water_cache
+    vm._build_near_water_cache = lambda grid: builds.append(vm.current_map_id) or build(grid)
+    grids = {1: [bytearray(10) for _ in range(10)], 2: [bytearray(10) for _ in range(10)]}
+    grids[1][0][0] = 2  # WATER
+    grids[2][9][9] = 2  # WATER
+    for _ in range(3):
+        for map_id, grid in grids.items():
+            vm.load_from_database(WorldSnapshot(map_id, 10, 10, grid, [], []))
+            assert vm._is_near_water(0, 0, grid) == (map_id == 1)
+            assert vm._is_near_water(9, 9, grid) == (map_id == 2)
+    assert builds == [1, 2]
+    updater.invalidate(1)
+    vm.load_from_database(WorldSnapshot(1, 10, 10, grids[1], [], []))
+    vm._is_near_water(0, 0, grids[1])
+    assert builds == [1, 2, 1]
+
 def main():
     """主测试函数"""
     print("开始测试村民系统...\n")
@@ -139,6 +310,15 @@ def main():
         test_task_system()
         test_farm_system()
         test_reproduction_system()
+        test_task_text_roundtrip()
+        test_hunger_does_not_interrupt_harvest()
+        test_count_farms_excludes_harvest_targets()
+        test_house_construction_throttle()
+        test_ring_candidates_cover_grid_in_distance_order()
+        test_near_water_matches_brute_force()
+        test_bernoulli_hits_marginals()
+        test_count_farms_matches_reference()
+        test_near_water_cache_per_map()
         
         print("\n✅ 所有测试完成！村民系统运行正常。")
         
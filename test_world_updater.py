@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+测试 WorldUpdater 的批量事务、单图 SAVEPOINT 回滚与地形缓存失效
+"""
+import sys
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core import database, pack_utils
+from core.config import Config
+from core.world_updater import WorldUpdater
+
+WIDTH, HEIGHT = 8, 6
+
+@contextmanager
+def temp_database():
+    """把 database 模块临时指向一个空的临时数据库文件"""
+    old_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "test.db")
+        try:
+            database.init_db()
+            yield
+        finally:
+            database.DB_PATH = old_path
+
+def create_map(name):
+    return database.insert_map(name, WIDTH, HEIGHT, pack_utils.pack_grid_to_3bit(bytes(WIDTH * HEIGHT)))
+
+def read_tiles(map_id):
+    _, _, map_data = database.get_map_by_id(map_id)
+    return pack_utils.unpack_3bit_bytes(map_data, WIDTH * HEIGHT)
+
+def make_updater(changes_for, during_update=None):
+    """
+    构造一个 WorldUpdater，村民逻辑换成固定的变更集：
+    changes_for(map_id) 返回 (tile_changes, 额外的变更字段)，瓦片变更像真实逻辑一样同步写进网格。
+    """
+    updater = WorldUpdater(Config())
+    vm = updater.villager_manager
+    vm.load_from_database = lambda snapshot: setattr(vm, "current_map_id", snapshot.map_id)
+    def update_villagers(current_tick, world_grid):
+        if during_update:
+            during_update()
+        tile_changes, extra = changes_for(vm.current_map_id)
+        for x, y, value in tile_changes:
+            world_grid[y][x] = value
+        return {"tile_changes": tile_changes, **extra}
+    vm.update_villagers = update_villagers
+    return updater
+
+def test_concurrent_writer_does_not_fail_batch():
+    """测试快照读取与提交之间有其他连接写入时，写入不被阻塞，整批 tick 仍然成功"""
+    print("=== 测试并发写入 ===")
+    with temp_database():
+        map_ids = [create_map("a"), create_map("b")]
+        writers, writers_done = [], []
+        def concurrent_insert():
+            if writers:
+                return
+            writer = threading.Thread(target=create_map, args=("concurrent",))
+            writers.append(writer)
+            writer.start()
+            # 村民逻辑运行期间不持有写锁，并发写入应当立即完成，而不是等到整批提交之后
+            writer.join(timeout=2.0)
+            writers_done.append(not writer.is_alive())
+        updater = make_updater(lambda map_id: ([(map_id, 0, 1)], {}), during_update=concurrent_insert)
+        results = updater.update_many({map_id: 1 for map_id in map_ids})
+        writers[0].join()
+        assert results == {map_id: True for map_id in map_ids}, results
+        assert writers_done == [True]
+        for map_id in map_ids:
+            assert read_tiles(map_id)[map_id] == 1, map_id
+        assert len(database.get_maps_list()) == 3
+
+def test_failed_map_rolls_back_only_itself():
+    """测试一张地图提交失败只回滚它自己的 SAVEPOINT，并丢弃它的地形缓存"""
+    print("=== 测试单图回滚 ===")
+    with temp_database():
+        good_id, bad_id = create_map("good"), create_map("bad")
+        def changes_for(map_id):
+            if map_id == bad_id:
+                # 地形补丁写入之后才在 villager_updates 上出错
+                return [(1, 1, 1)], {"villager_updates": [object()]}
+            return [(1, 1, 1)], {}
+        updater = make_updater(changes_for)
+        results = updater.update_many({good_id: 1, bad_id: 1})
+        assert results == {good_id: True, bad_id: False}, results
+        assert read_tiles(good_id)[WIDTH + 1] == 1
+        assert read_tiles(bad_id)[WIDTH + 1] == 0
+        assert good_id in updater._grid_cache
+        assert bad_id not in updater._grid_cache
+
+        # 下一个 tick 会重新从数据库读取，不会沿用被就地改过的网格
+        updater.villager_manager.update_villagers = lambda current_tick, world_grid: {"tile_changes": [(0, 0, world_grid[1][1])]}
+        assert updater.update_many({bad_id: 2}) == {bad_id: True}
+        assert read_tiles(bad_id)[0] == 0
+
+def test_failed_batch_commit_invalidates_all():
+    """测试整批提交失败时所有地图都报告失败，且地形缓存全部丢弃"""
+    print("=== 测试整批提交失败 ===")
+    with temp_database():
+        map_ids = [create_map("a"), create_map("b")]
+        updater = make_updater(lambda map_id: ([(2, 2, 1)], {}))
+        assert updater.update_many({map_id: 1 for map_id in map_ids}) == {map_id: True for map_id in map_ids}
+        assert set(updater._grid_cache) == set(map_ids)
+
+        original_transaction = database.transaction
+        @contextmanager
+        def failing_transaction():
+            with original_transaction() as conn:
+                yield conn
+                raise database.DatabaseError("simulated commit failure")
+        database.transaction = failing_transaction
+        try:
+            results = updater.update_many({map_id: 2 for map_id in map_ids})
+        finally:
+            database.transaction = original_transaction
+        assert results == {map_id: False for map_id in map_ids}, results
+        assert updater._grid_cache == {}
+
+def main():
+    """主测试函数"""
+    print("开始测试批量事务...\n")
+    test_concurrent_writer_does_not_fail_batch()
+    test_failed_map_rolls_back_only_itself()
+    test_failed_batch_commit_invalidates_all()
+    print("\n✅ 所有测试完成！")
+
+if __name__ == "__main__":
+    main()